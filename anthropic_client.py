@@ -1,25 +1,258 @@
+import asyncio
 import os
+import random
+import weakref
+from typing import TYPE_CHECKING, Dict, Optional
 from fastapi import FastAPI
-from anthropic import AsyncAnthropic
-from contextlib import asynccontextmanager
+from contextlib import AsyncExitStack, asynccontextmanager
+from scheduler import FairScheduler
+
+# The SDK (with httpx and its pydantic models) is only imported once a client is created
+if TYPE_CHECKING:
+    import httpx
+    from anthropic import AsyncAnthropic
+
+# Upstream HTTP connection pool
+HTTP_MAX_CONNECTIONS = int(os.getenv("THERABOT_HTTP_MAX_CONNECTIONS", "100"))
+HTTP_MAX_KEEPALIVE = int(os.getenv("THERABOT_HTTP_MAX_KEEPALIVE", "20"))
+HTTP_KEEPALIVE_EXPIRY = float(os.getenv("THERABOT_HTTP_KEEPALIVE_EXPIRY", "30"))
+HTTP_CONNECT_TIMEOUT = float(os.getenv("THERABOT_HTTP_CONNECT_TIMEOUT", "5"))
+HTTP_READ_TIMEOUT = float(os.getenv("THERABOT_HTTP_READ_TIMEOUT", "60"))
+
+# Concurrency limiting: at most MAX_CONCURRENT_STREAMS upstream streams (and
+# MAX_STREAMS_PER_SESSION per session) at once, with up to MAX_WAITING_STREAMS
+# requests queued behind them before new ones are turned away as busy. A session
+# may queue MAX_QUEUED_TURNS_PER_SESSION turns behind its own running ones; further
+# turns are rejected. Free upstream slots go round-robin across sessions, so a session
+# with several turns queued can't crowd out the others. Sessions are the unit rather
+# than client IPs, since a whole classroom may share one address.
+MAX_CONCURRENT_STREAMS = int(os.getenv("THERABOT_MAX_CONCURRENT_STREAMS", "32"))
+MAX_STREAMS_PER_SESSION = int(os.getenv("THERABOT_MAX_STREAMS_PER_SESSION", "1"))
+MAX_WAITING_STREAMS = int(os.getenv("THERABOT_MAX_WAITING_STREAMS", "64"))
+MAX_QUEUED_TURNS_PER_SESSION = int(os.getenv("THERABOT_MAX_QUEUED_TURNS_PER_SESSION", "0"))
+
+# Retries when the API answers 429 (rate limited) or 529/503 (overloaded)
+MAX_RETRIES = int(os.getenv("THERABOT_MAX_RETRIES", "3"))
+RETRY_BASE_DELAY = float(os.getenv("THERABOT_RETRY_BASE_DELAY", "0.5"))
+RETRY_MAX_DELAY = float(os.getenv("THERABOT_RETRY_MAX_DELAY", "8"))
+RETRYABLE_STATUS = {429, 503, 529}
+
+# Create the client on the first chat request rather than at startup, so a fresh
+# instance (e.g. a newly scaled-up container) starts serving sooner
+LAZY_CLIENT = os.getenv("THERABOT_LAZY_CLIENT", "0") == "1"
 
 anthropic_client = None
+client_manager = None
+
+
+class ServerBusy(Exception):
+    """Raised when the upstream wait queue is full, or retries against a busy API ran out."""
+
+    def __init__(self, retry_after: float, message: str = "The server is busy, please try again in a moment."):
+        super().__init__(message)
+        self.retry_after = retry_after
+
+
+class SessionBusy(ServerBusy):
+    """Raised when a session already has as many turns running and queued as it may."""
+
+    def __init__(self, retry_after: float):
+        super().__init__(retry_after, "Please wait for the patient to finish replying before sending another message.")
+
+
+def retry_delay(attempt: int, retry_after=None, base: float = RETRY_BASE_DELAY, cap: float = RETRY_MAX_DELAY) -> float:
+    """Full-jitter exponential backoff, never shorter than the server's Retry-After."""
+    delay = random.uniform(0, min(cap, base * 2 ** attempt))
+    if retry_after:
+        try:
+            delay = max(delay, float(retry_after))
+        except ValueError:
+            pass
+    return delay
+
+
+class ClientManager:
+    """Wraps an ``AsyncAnthropic`` client with concurrency limits, a bounded wait queue and retries."""
+
+    def __init__(
+        self,
+        client: "AsyncAnthropic",
+        max_concurrent: int = MAX_CONCURRENT_STREAMS,
+        per_session: int = MAX_STREAMS_PER_SESSION,
+        max_waiting: int = MAX_WAITING_STREAMS,
+        max_retries: int = MAX_RETRIES,
+        max_queued_per_session: int = MAX_QUEUED_TURNS_PER_SESSION,
+    ):
+        self.client = client
+        self.per_session = per_session
+        self.max_waiting = max_waiting
+        self.max_retries = max_retries
+        self.max_session_turns = per_session + max_queued_per_session
+        self._global = FairScheduler(max_concurrent)
+        self._sessions: "weakref.WeakValueDictionary[str, asyncio.Semaphore]" = weakref.WeakValueDictionary()
+        # Turns running or waiting, per session
+        self._session_turns: Dict[str, int] = {}
+        self.waiting = 0
+        self.active = 0
+        self.rejected = 0
+        self.retries = 0
+
+    @asynccontextmanager
+    async def session_slot(self, session_id: str):
+        """Hold one of the session's turn slots, so its turns run one after another.
+
+        Raises ``SessionBusy`` when this session already has its fill of turns
+        running and queued, or ``ServerBusy`` when ``max_waiting`` requests are
+        already waiting.
+        """
+        turns = self._session_turns.get(session_id, 0)
+        if turns >= self.max_session_turns:
+            self.rejected += 1
+            raise SessionBusy(retry_after=retry_delay(1))
+        session_slots = self._sessions.get(session_id)
+        if session_slots is None:
+            session_slots = self._sessions[session_id] = asyncio.Semaphore(self.per_session)
+        if session_slots.locked() and self.waiting >= self.max_waiting:
+            self.rejected += 1
+            raise ServerBusy(retry_after=retry_delay(1))
+
+        self._session_turns[session_id] = turns + 1
+        try:
+            self.waiting += 1
+            try:
+                await session_slots.acquire()
+            finally:
+                self.waiting -= 1
+            try:
+                yield
+            finally:
+                session_slots.release()
+        finally:
+            remaining = self._session_turns[session_id] - 1
+            if remaining:
+                self._session_turns[session_id] = remaining
+            else:
+                del self._session_turns[session_id]
+
+    @asynccontextmanager
+    async def upstream_slot(self, session_id: str):
+        """Hold one of the global upstream stream slots, shared round-robin between sessions.
+
+        Waits in line if they are all taken, or raises ``ServerBusy`` straight
+        away when ``max_waiting`` requests are already waiting.
+        """
+        if self._global.locked() and self.waiting >= self.max_waiting:
+            self.rejected += 1
+            raise ServerBusy(retry_after=retry_delay(1))
+        self.waiting += 1
+        try:
+            await self._global.acquire(session_id)
+        finally:
+            self.waiting -= 1
+
+        self.active += 1
+        try:
+            yield
+        finally:
+            self.active -= 1
+            self._global.release()
+
+    @asynccontextmanager
+    async def slot(self, session_id: str):
+        """Hold one of the session's and one of the global stream slots (see ``session_slot``
+        and ``upstream_slot``).
+        """
+        async with self.session_slot(session_id):
+            async with self.upstream_slot(session_id):
+                yield
+
+    @asynccontextmanager
+    async def stream(self, max_retries: Optional[int] = None, **kwargs):
+        """Open ``client.messages.stream(**kwargs)``, retrying while the API is rate limited or overloaded.
+
+        Only opening the stream is retried; once text has started flowing an
+        error is passed on as-is. ``max_retries`` overrides the manager's default.
+        """
+        if max_retries is None:
+            max_retries = self.max_retries
+        from anthropic import APIStatusError
+
+        async with AsyncExitStack() as stack:
+            for attempt in range(max_retries + 1):
+                try:
+                    stream = await stack.enter_async_context(self.client.messages.stream(**kwargs))
+                    break
+                except APIStatusError as e:
+                    if e.status_code not in RETRYABLE_STATUS:
+                        raise
+                    retry_after = e.response.headers.get("retry-after")
+                    if attempt == max_retries:
+                        raise ServerBusy(retry_after=retry_delay(attempt, retry_after)) from e
+                    self.retries += 1
+                    await asyncio.sleep(retry_delay(attempt, retry_after))
+            yield stream
+
+    def stats(self):
+        return {
+            "active_streams": self.active,
+            "waiting_streams": self.waiting,
+            "rejected_streams": self.rejected,
+            "retries": self.retries,
+        }
+
+
+def create_http_client() -> "httpx.AsyncClient":
+    import httpx
+
+    return httpx.AsyncClient(
+        limits=httpx.Limits(
+            max_connections=HTTP_MAX_CONNECTIONS,
+            max_keepalive_connections=HTTP_MAX_KEEPALIVE,
+            keepalive_expiry=HTTP_KEEPALIVE_EXPIRY,
+        ),
+        timeout=httpx.Timeout(HTTP_READ_TIMEOUT, connect=HTTP_CONNECT_TIMEOUT),
+    )
+
+
+def init_client():
+    global anthropic_client, client_manager
+    from anthropic import AsyncAnthropic
+
+    # Retries are handled by ClientManager so they can respect the wait queue
+    anthropic_client = AsyncAnthropic(
+        api_key=os.getenv("ANTHROPIC_API_KEY"), http_client=create_http_client(), max_retries=0
+    )
+    client_manager = ClientManager(anthropic_client)
+
 
 @asynccontextmanager
 async def lifespan(app: FastAPI):
-    print("Starting up...")
-    api_key = os.getenv("ANTHROPIC_API_KEY")
-    if api_key:
-        global anthropic_client
-        anthropic_client = AsyncAnthropic(api_key=api_key)
-        print("Anthropic client initialized successfully.")
+    from metrics import log_event
+
+    log_event("startup")
+    if os.getenv("ANTHROPIC_API_KEY"):
+        if LAZY_CLIENT:
+            log_event("anthropic_client", status="lazy")
+        else:
+            init_client()
+            log_event("anthropic_client", status="initialized")
     else:
-        print("Warning: ANTHROPIC_API_KEY not set. The Anthropic client will not be initialized.")
+        log_event("anthropic_client", status="disabled", warning="ANTHROPIC_API_KEY not set")
     yield
-    print("Shutting down...")
+    log_event("shutdown")
+    if anthropic_client is not None:
+        await anthropic_client.close()
 
 async def get_anthropic_client():
-    global anthropic_client
+    if anthropic_client is None and LAZY_CLIENT and os.getenv("ANTHROPIC_API_KEY"):
+        init_client()
     if anthropic_client is None:
         raise RuntimeError("Anthropic client is not initialized")
     return anthropic_client
+
+async def get_client_manager():
+    if client_manager is None and LAZY_CLIENT and os.getenv("ANTHROPIC_API_KEY"):
+        init_client()
+    if client_manager is None:
+        raise RuntimeError("Anthropic client is not initialized")
+    return client_manager
@@ -0,0 +1,100 @@
+"""Deterministic stand-ins for the Anthropic streaming API, for benchmarks."""
+import asyncio
+import random
+from types import SimpleNamespace
+
+import httpx
+from anthropic import RateLimitError
+
+SAMPLE_REPLY = (
+    "I don't really know where to start. It's been hard to get out of bed most days, "
+    "and I keep telling myself it'll pass, but it hasn't. My sister said I should talk to someone, "
+    "so here I am, I guess. "
+)
+
+
+def reply_tokens(n_tokens: int, text: str = SAMPLE_REPLY):
+    """Split ``text`` into word-sized tokens, repeated until there are ``n_tokens`` of them."""
+    words = [w + " " for w in text.split()]
+    return [words[i % len(words)] for i in range(n_tokens)]
+
+
+class FakeMessageStream:
+    """Async context manager/iterator shaped like ``client.messages.stream(...)``."""
+
+    def __init__(self, tokens, ttft: float = 0.0, token_interval: float = 0.0, fail: bool = False):
+        self.tokens = tokens
+        self.ttft = ttft
+        self.token_interval = token_interval
+        self.fail = fail
+
+    async def __aenter__(self):
+        if self.fail:
+            response = httpx.Response(429, request=httpx.Request("POST", "https://fake.invalid/v1/messages"))
+            raise RateLimitError("Fake rate limit", response=response, body=None)
+        return self
+
+    async def __aexit__(self, *exc_info):
+        return False
+
+    def __aiter__(self):
+        return self._events()
+
+    async def _events(self):
+        yield SimpleNamespace(type="message_start")
+        if self.ttft:
+            await asyncio.sleep(self.ttft)
+        for token in self.tokens:
+            if self.token_interval:
+                await asyncio.sleep(self.token_interval)
+            yield SimpleNamespace(type="content_block_delta", delta=SimpleNamespace(type="text_delta", text=token))
+        yield SimpleNamespace(type="message_stop")
+
+    async def get_final_message(self):
+        usage = SimpleNamespace(
+            input_tokens=0,
+            output_tokens=len(self.tokens),
+            cache_read_input_tokens=0,
+            cache_creation_input_tokens=0,
+        )
+        return SimpleNamespace(usage=usage, stop_reason="end_turn")
+
+
+class FakeAsyncAnthropic:
+    """Stand-in for ``AsyncAnthropic`` whose ``messages.stream`` replies with canned text.
+
+    ``ttft`` is the delay before the first token, ``tokens_per_sec`` the pace
+    after that (0 for as fast as possible), ``reply_length`` the number of
+    tokens per reply and ``error_rate`` the fraction of requests rejected
+    with a 429. With ``record``, the keyword arguments of every request are
+    kept in ``calls`` (e.g. to inspect cache-control blocks).
+    """
+
+    def __init__(
+        self,
+        ttft: float = 0.3,
+        tokens_per_sec: float = 60.0,
+        reply_length: int = 60,
+        error_rate: float = 0.0,
+        seed: int = 0,
+        record: bool = False,
+    ):
+        self.ttft = ttft
+        self.token_interval = 1 / tokens_per_sec if tokens_per_sec else 0.0
+        self.tokens = reply_tokens(reply_length)
+        self.error_rate = error_rate
+        self.rng = random.Random(seed)
+        self.record = record
+        self.calls = []
+        self.requests = 0
+        self.messages = SimpleNamespace(stream=self._stream)
+
+    def _stream(self, **kwargs):
+        self.requests += 1
+        if self.record:
+            self.calls.append(kwargs)
+        fail = self.rng.random() < self.error_rate
+        return FakeMessageStream(self.tokens, self.ttft, self.token_interval, fail=fail)
+
+    async def close(self):
+        pass
@@ -0,0 +1,186 @@
+"""Load test of the FastAPI app against a fake Anthropic backend.
+
+Starts the app under uvicorn on a local port with ``FakeAsyncAnthropic`` in
+place of the real client, then has N simulated students each open a session
+with ``/new-context`` and hold a multi-turn ``/chat`` conversation. Reports
+throughput, time-to-first-byte and full-response latency percentiles, and the
+growth of the process's resident memory. Run from the repository root:
+
+    python -m benchmarks.load_test --students 50 --turns 8
+
+Client and server share one process and event loop, so absolute numbers are
+pessimistic; compare runs against each other to catch regressions.
+"""
+import argparse
+import asyncio
+import json
+import os
+import random
+import resource
+import socket
+import time
+from typing import Dict, List
+
+import httpx
+import uvicorn
+
+# Every simulated student connects from 127.0.0.1 and sends turns back to back,
+# so the per-IP and per-session rate limits are off unless set explicitly
+os.environ.setdefault("THERABOT_SESSION_TURNS_PER_MINUTE", "0")
+os.environ.setdefault("THERABOT_IP_TURNS_PER_MINUTE", "0")
+
+from anthropic_client import ClientManager, get_client_manager
+from benchmarks.fake_anthropic import FakeAsyncAnthropic
+from main import app
+
+QUESTIONS = (
+    "Hi, thanks for coming in today. What brings you here?",
+    "How long has this been going on?",
+    "Can you tell me a bit more about that?",
+    "How has this been affecting your sleep?",
+    "What about work or school, how are things there?",
+    "Who do you have around you for support?",
+    "Have you ever talked to anyone about this before?",
+    "Is there anything else you think I should know?",
+)
+
+
+def rss_bytes() -> int:
+    """Current resident set size, falling back to the peak where /proc is unavailable."""
+    try:
+        with open("/proc/self/statm") as statm:
+            return int(statm.read().split()[1]) * resource.getpagesize()
+    except OSError:
+        return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss * 1024
+
+
+def percentile(values: List[float], pct: float) -> float:
+    if not values:
+        return float("nan")
+    ordered = sorted(values)
+    index = min(len(ordered) - 1, max(0, round(pct / 100 * len(ordered)) - 1))
+    return ordered[index]
+
+
+def free_port() -> int:
+    with socket.socket() as sock:
+        sock.bind(("127.0.0.1", 0))
+        return sock.getsockname()[1]
+
+
+async def chat_turn(client: httpx.AsyncClient, message: str, results: Dict):
+    start = time.perf_counter()
+    first_byte = None
+    outcome = "error"
+    async with client.stream("POST", "/chat", data={"message": message}) as response:
+        pending = ""
+        async for text in response.aiter_text():
+            if first_byte is None and '"delta"' in text:
+                first_byte = time.perf_counter() - start
+            pending += text
+            frames = pending.split("\n\n")
+            pending = frames.pop()
+            for frame in frames:
+                if not frame.startswith("data: "):
+                    continue
+                data = json.loads(frame[6:])
+                if data.get("done"):
+                    outcome = "ok"
+                elif data.get("busy"):
+                    outcome = "busy"
+                elif data.get("error"):
+                    outcome = "error"
+    results[outcome] += 1
+    if outcome == "ok":
+        results["ttfb"].append(first_byte)
+        results["latency"].append(time.perf_counter() - start)
+
+
+async def student(base_url: str, index: int, args, results: Dict):
+    rng = random.Random(index)
+    # /new-context sets the session cookie, which the client then sends with each turn
+    async with httpx.AsyncClient(base_url=base_url, timeout=60) as client:
+        response = await client.post("/new-context")
+        response.raise_for_status()
+        results["sessions"] += 1
+        for turn in range(args.turns):
+            if args.think_time:
+                await asyncio.sleep(rng.uniform(0, 2 * args.think_time))
+            await chat_turn(client, QUESTIONS[turn % len(QUESTIONS)], results)
+
+
+async def run(args):
+    fake = FakeAsyncAnthropic(
+        ttft=args.ttft,
+        tokens_per_sec=args.tokens_per_sec,
+        reply_length=args.reply_tokens,
+        error_rate=args.error_rate,
+    )
+    manager = ClientManager(fake)
+    app.dependency_overrides[get_client_manager] = lambda: manager
+
+    port = free_port()
+    server = uvicorn.Server(uvicorn.Config(app, host="127.0.0.1", port=port, log_level="warning"))
+    server_task = asyncio.create_task(server.serve())
+    while not server.started:
+        await asyncio.sleep(0.01)
+
+    results = {"sessions": 0, "ok": 0, "busy": 0, "error": 0, "ttfb": [], "latency": []}
+    rss_before = rss_bytes()
+    start = time.perf_counter()
+    await asyncio.gather(
+        *(student(f"http://127.0.0.1:{port}", i, args, results) for i in range(args.students))
+    )
+    elapsed = time.perf_counter() - start
+    rss_after = rss_bytes()
+
+    server.should_exit = True
+    await server_task
+    app.dependency_overrides.pop(get_client_manager, None)
+
+    turns = results["ok"] + results["busy"] + results["error"]
+    report = {
+        "students": args.students,
+        "turns": turns,
+        "ok": results["ok"],
+        "busy": results["busy"],
+        "errors": results["error"],
+        "elapsed_s": round(elapsed, 3),
+        "turns_per_s": round(turns / elapsed, 2),
+        "ttfb_ms": {p: round(percentile(results["ttfb"], p) * 1000, 1) for p in (50, 95, 99)},
+        "latency_ms": {p: round(percentile(results["latency"], p) * 1000, 1) for p in (50, 95, 99)},
+        "rss_before_mb": round(rss_before / 2**20, 1),
+        "rss_after_mb": round(rss_after / 2**20, 1),
+        "rss_growth_mb": round((rss_after - rss_before) / 2**20, 1),
+    }
+    return report
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--students", type=int, default=50, help="Concurrent simulated students")
+    parser.add_argument("--turns", type=int, default=8, help="Chat turns per student")
+    parser.add_argument("--think-time", type=float, default=0.0, help="Mean seconds between a student's turns")
+    parser.add_argument("--ttft", type=float, default=0.3, help="Fake time to first token, seconds")
+    parser.add_argument("--tokens-per-sec", type=float, default=60.0, help="Fake output speed (0 = unthrottled)")
+    parser.add_argument("--reply-tokens", type=int, default=60, help="Tokens per fake reply")
+    parser.add_argument("--error-rate", type=float, default=0.0, help="Fraction of fake requests answered with 429")
+    parser.add_argument("--json", action="store_true", help="Print the report as JSON")
+    args = parser.parse_args()
+
+    report = asyncio.run(run(args))
+    if args.json:
+        print(json.dumps(report))
+        return
+    print(f"students={report['students']} turns={report['turns']} ok={report['ok']} "
+          f"busy={report['busy']} errors={report['errors']}")
+    print(f"throughput: {report['turns_per_s']} turns/s over {report['elapsed_s']} s")
+    for name in ("ttfb_ms", "latency_ms"):
+        values = report[name]
+        print(f"{name}: p50={values[50]} p95={values[95]} p99={values[99]}")
+    print(f"rss: {report['rss_before_mb']} MB -> {report['rss_after_mb']} MB "
+          f"(+{report['rss_growth_mb']} MB)")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,146 @@
+"""Session issuance under load: thousands of concurrent new sessions.
+
+Drives the app in-process (no sockets) with N concurrent ``/new-context``
+calls, each from a fresh browser without a cookie, and checks that every
+one got its own signed session ID and its own store entry. It then sends
+forged and unsigned cookies to ``/chat``, which must all be rejected, and
+measures lookup/update throughput of the session store from several
+threads with and without sharding. Run from the repository root:
+
+    python -m benchmarks.sessions --sessions 5000 --concurrency 500
+"""
+import argparse
+import asyncio
+import json
+import os
+import tempfile
+import threading
+import time
+from typing import Dict, List
+
+# Keep the benchmark's transcripts out of the working directory
+os.environ.setdefault("THERABOT_TRANSCRIPT_DB_PATH", os.path.join(tempfile.mkdtemp(), "transcripts.db"))
+os.environ.setdefault("THERABOT_SESSION_MAX_COUNT", "100000")
+
+import httpx
+
+from benchmarks.load_test import percentile
+from main import app
+from models import SESSION_SECRET, transcript_log, user_contexts
+from session_store import create_session_store
+from session_tokens import verify_session_id
+
+
+async def new_sessions(client: httpx.AsyncClient, count: int, concurrency: int) -> Dict:
+    limit = asyncio.Semaphore(concurrency)
+    session_ids: List[str] = []
+    latencies: List[float] = []
+
+    async def visit():
+        async with limit:
+            start = time.perf_counter()
+            response = await client.post("/new-context")
+            latencies.append(time.perf_counter() - start)
+            response.raise_for_status()
+            session_ids.append(response.cookies["session_id"])
+
+    start = time.perf_counter()
+    await asyncio.gather(*(visit() for _ in range(count)))
+    elapsed = time.perf_counter() - start
+    return {
+        "sessions": count,
+        "unique_ids": len(set(session_ids)),
+        "valid_signatures": sum(verify_session_id(session_id, SESSION_SECRET) for session_id in session_ids),
+        "stored": sum(session_id in user_contexts for session_id in session_ids),
+        "elapsed_s": round(elapsed, 3),
+        "sessions_per_s": round(count / elapsed, 1),
+        "latency_ms": {p: round(percentile(latencies, p) * 1000, 2) for p in (50, 99)},
+        "ids": session_ids,
+    }
+
+
+async def rejected_cookies(client: httpx.AsyncClient, valid_id: str, count: int) -> Dict:
+    session_id, _, signature = valid_id.partition(".")
+    forged = [f"{session_id}.{signature[::-1]}", "None", "", f"bench-{count}", f"{session_id[::-1]}.{signature}"]
+    statuses = []
+    start = time.perf_counter()
+    for n in range(count):
+        response = await client.post(
+            "/chat", data={"message": "hi"}, headers={"cookie": f"session_id={forged[n % len(forged)]}"}
+        )
+        statuses.append(response.status_code)
+    elapsed = time.perf_counter() - start
+    return {
+        "requests": count,
+        "rejected_401": statuses.count(401),
+        "per_request_ms": round(elapsed / count * 1000, 3),
+    }
+
+
+def store_throughput(shards: int, threads: int, sessions: int, operations: int) -> Dict:
+    """Lookups and updates per second from ``threads`` threads hammering one store."""
+    store = create_session_store("memory", max_sessions=sessions * 2, shards=shards)
+    session_ids = [f"s{n}" for n in range(sessions)]
+    for session_id in session_ids:
+        store[session_id] = {"messages": [], "turns": 0}
+
+    def work(offset: int):
+        for n in range(operations):
+            session_id = session_ids[(offset + n * 7919) % sessions]
+            if n % 4:
+                store[session_id]
+            else:
+                store.update(session_id, lambda context: context.__setitem__("turns", context["turns"] + 1))
+
+    workers = [threading.Thread(target=work, args=(n,)) for n in range(threads)]
+    start = time.perf_counter()
+    for worker in workers:
+        worker.start()
+    for worker in workers:
+        worker.join()
+    elapsed = time.perf_counter() - start
+    return {"shards": shards, "threads": threads, "ops_per_s": round(threads * operations / elapsed)}
+
+
+async def run(args) -> Dict:
+    transport = httpx.ASGITransport(app=app)
+    async with httpx.AsyncClient(transport=transport, base_url="http://therabot.test") as client:
+        issued = await new_sessions(client, args.sessions, args.concurrency)
+        rejected = await rejected_cookies(client, issued.pop("ids")[0], args.forged)
+    await transcript_log.close()
+    stores = [store_throughput(shards, args.threads, 1000, args.operations) for shards in (1, 16)]
+    return {"new_sessions": issued, "forged_cookies": rejected, "store": stores}
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--sessions", type=int, default=5000, help="New sessions to create")
+    parser.add_argument("--concurrency", type=int, default=500, help="New-session requests in flight at once")
+    parser.add_argument("--forged", type=int, default=500, help="Requests with forged cookies")
+    parser.add_argument("--threads", type=int, default=8, help="Threads for the store throughput test")
+    parser.add_argument("--operations", type=int, default=20000, help="Store operations per thread")
+    parser.add_argument("--json", action="store_true", help="Print the report as JSON")
+    args = parser.parse_args()
+
+    report = asyncio.run(run(args))
+    if args.json:
+        print(json.dumps(report))
+        return
+    issued = report["new_sessions"]
+    print(f"new sessions: {issued['sessions']} in {issued['elapsed_s']} s ({issued['sessions_per_s']}/s), "
+          f"p50={issued['latency_ms'][50]} ms p99={issued['latency_ms'][99]} ms")
+    print(f"  unique ids={issued['unique_ids']} valid signatures={issued['valid_signatures']} "
+          f"stored={issued['stored']}")
+    rejected = report["forged_cookies"]
+    print(f"forged cookies: {rejected['rejected_401']}/{rejected['requests']} rejected, "
+          f"{rejected['per_request_ms']} ms per request")
+    for store in report["store"]:
+        print(f"store: shards={store['shards']} threads={store['threads']} {store['ops_per_s']} ops/s")
+    ok = issued["unique_ids"] == issued["valid_signatures"] == issued["stored"] == issued["sessions"]
+    ok = ok and rejected["rejected_401"] == rejected["requests"]
+    print("OK" if ok else "FAILED")
+    raise SystemExit(0 if ok else 1)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,73 @@
+"""Micro-benchmark of the /chat SSE stage against a fake token stream.
+
+Compares the original per-token ``json.dumps`` + string ``+=`` generator with
+the coalescing encoder in ``streaming.py``. Run from the repository root:
+
+    python -m benchmarks.sse_stream --responses 200 --tokens 400
+"""
+import argparse
+import asyncio
+import json
+import time
+
+from benchmarks.fake_anthropic import FakeMessageStream, reply_tokens
+from streaming import coalesced_sse, text_deltas
+
+
+async def legacy_generator(stream):
+    async with stream:
+        full_response = ""
+        async for chunk in stream:
+            if chunk.type == "content_block_delta":
+                delta_text = chunk.delta.text
+                full_response += delta_text
+                yield f"data: {json.dumps({'delta': delta_text})}\n\n"
+        yield f"data: {json.dumps({'done': True})}\n\n"
+
+
+async def coalesced_generator(stream, flush_interval, flush_chars):
+    async with stream:
+        parts = []
+        async for frame in coalesced_sse(text_deltas(stream), parts, flush_interval, flush_chars):
+            yield frame
+        "".join(parts)
+        yield b'data: {"done": true}\n\n'
+
+
+async def run(name, make_generator, args):
+    tokens = reply_tokens(args.tokens)
+    frames = 0
+    size = 0
+    wall = time.perf_counter()
+    cpu = time.process_time()
+    for _ in range(args.responses):
+        stream = FakeMessageStream(tokens, token_interval=args.token_interval)
+        async for frame in make_generator(stream):
+            frames += 1
+            size += len(frame)
+    wall = time.perf_counter() - wall
+    cpu = time.process_time() - cpu
+    print(
+        f"{name:>10}: {frames / args.responses:8.1f} frames/response  "
+        f"{frames / wall:10.0f} frames/s  {cpu / args.responses * 1000:8.3f} ms CPU/response  "
+        f"{size / args.responses:8.0f} bytes/response"
+    )
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--responses", type=int, default=200, help="Responses to stream per variant")
+    parser.add_argument("--tokens", type=int, default=400, help="Tokens per response")
+    parser.add_argument("--token-interval", type=float, default=0.0, help="Seconds between fake tokens")
+    parser.add_argument("--flush-interval", type=float, default=0.05)
+    parser.add_argument("--flush-chars", type=int, default=200)
+    args = parser.parse_args()
+
+    asyncio.run(run("legacy", legacy_generator, args))
+    asyncio.run(
+        run("coalesced", lambda s: coalesced_generator(s, args.flush_interval, args.flush_chars), args)
+    )
+
+
+if __name__ == "__main__":
+    main()
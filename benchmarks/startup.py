@@ -0,0 +1,115 @@
+"""Cold-start benchmark: import time and time to serve the first request.
+
+Every run uses a fresh Python process, so nothing is warm but the OS file
+cache and bytecode. Reports the median over ``--runs`` of:
+
+- import: ``import main``
+- ready: from launching uvicorn until it accepts connections
+- first_request: latency of the first ``GET /``
+- serving: from launch until that first response has arrived
+
+Run from the repository root, e.g. to compare startup modes:
+
+    python -m benchmarks.startup
+    python -m benchmarks.startup --lazy-client --precompiled
+"""
+import argparse
+import json
+import os
+import socket
+import statistics
+import subprocess
+import sys
+import tempfile
+import time
+
+import httpx
+
+from benchmarks.load_test import free_port
+
+IMPORT_SNIPPET = "import time; start = time.perf_counter(); import main; print(time.perf_counter() - start)"
+
+
+def time_import(env) -> float:
+    output = subprocess.run(
+        [sys.executable, "-c", IMPORT_SNIPPET], env=env, check=True, capture_output=True, text=True
+    ).stdout
+    return float(output.strip().splitlines()[-1])
+
+
+def wait_for_port(port: int, process: subprocess.Popen, timeout: float = 30.0):
+    deadline = time.perf_counter() + timeout
+    while time.perf_counter() < deadline:
+        if process.poll() is not None:
+            raise RuntimeError("server exited during startup")
+        try:
+            with socket.create_connection(("127.0.0.1", port), timeout=0.1):
+                return
+        except OSError:
+            time.sleep(0.005)
+    raise TimeoutError("server did not start")
+
+
+def time_first_request(env):
+    port = free_port()
+    start = time.perf_counter()
+    process = subprocess.Popen(
+        [sys.executable, "-m", "uvicorn", "main:app", "--host", "127.0.0.1", "--port", str(port), "--log-level", "warning"],
+        env=env,
+        stdout=subprocess.DEVNULL,
+        stderr=subprocess.DEVNULL,
+    )
+    try:
+        wait_for_port(port, process)
+        ready = time.perf_counter() - start
+        request_start = time.perf_counter()
+        httpx.get(f"http://127.0.0.1:{port}/").raise_for_status()
+        now = time.perf_counter()
+        return ready, now - request_start, now - start
+    finally:
+        process.terminate()
+        process.wait()
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--runs", type=int, default=5, help="Fresh processes per measurement")
+    parser.add_argument("--lazy-client", action="store_true", help="Create the Anthropic client on first use")
+    parser.add_argument("--precompiled", action="store_true", help="Load prompt templates from a precompiled artifact")
+    parser.add_argument("--json", action="store_true", help="Print the report as JSON")
+    args = parser.parse_args()
+
+    env = dict(os.environ)
+    # A dummy key, so the client is created at startup unless it is lazy
+    env.setdefault("ANTHROPIC_API_KEY", "startup-benchmark")
+    env["THERABOT_LAZY_CLIENT"] = "1" if args.lazy_client else "0"
+    with tempfile.TemporaryDirectory() as tmp:
+        artifact = os.path.join(tmp, "precompiled_templates.bin")
+        env["THERABOT_PRECOMPILED_TEMPLATES_PATH"] = artifact if args.precompiled else ""
+        env["THERABOT_TRANSCRIPT_DB_PATH"] = os.path.join(tmp, "transcripts.db")
+        if args.precompiled:
+            subprocess.run([sys.executable, "precompile.py", "--out", artifact], env=env, check=True, capture_output=True)
+
+        imports = [time_import(env) for _ in range(args.runs)]
+        requests = [time_first_request(env) for _ in range(args.runs)]
+
+    report = {
+        "lazy_client": args.lazy_client,
+        "precompiled": args.precompiled,
+        "runs": args.runs,
+        "import_ms": round(statistics.median(imports) * 1000, 1),
+        "ready_ms": round(statistics.median(r[0] for r in requests) * 1000, 1),
+        "first_request_ms": round(statistics.median(r[1] for r in requests) * 1000, 1),
+        "serving_ms": round(statistics.median(r[2] for r in requests) * 1000, 1),
+    }
+    if args.json:
+        print(json.dumps(report))
+        return
+    print(f"lazy_client={report['lazy_client']} precompiled={report['precompiled']} runs={report['runs']}")
+    print(f"import: {report['import_ms']} ms")
+    print(f"ready: {report['ready_ms']} ms, first GET /: {report['first_request_ms']} ms, "
+          f"launch to first response: {report['serving_ms']} ms")
+
+
+if __name__ == "__main__":
+    main()
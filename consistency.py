@@ -0,0 +1,84 @@
+import re
+from typing import AsyncIterator, Dict, Optional
+from models import PATIENT_NAMES
+
+# Explicit first-person age statements only: "I'm 34 years old", "I am a 34-year-old",
+# or "I'm 34" ending a clause. "I'm 2 years sober", "I'm 5 foot 4" or "I'm 1 of 3 kids" don't count
+AGE_PATTERN = re.compile(
+    r"\b(?:I'm|I am|I turned)\s+(?:an?\s+)?(\d{1,3})"
+    r"(?:\s*[-–]?\s*(?:years?|yrs?)[\s-]*old\b|(?=\s*(?:[,;:!?]|\.(?!\d)|$)))",
+    re.IGNORECASE,
+)
+# Explicit introductions: a name that isn't the patient's (or a short form of it) is a contradiction
+NAME_PATTERN = re.compile(r"\b(?:[Mm]y name is|[Mm]y name's)\s+([A-Z][a-z]+)\b(?![-'’])")
+# "I'm Jordan": only counts when the word is one of the names patients are given,
+# so "I'm Sorry" or "I am Catholic" aren't mistaken for names, and not when it
+# is part of a longer word or a possessive ("I'm London-based", "I'm Sam's friend")
+SELF_NAME_PATTERN = re.compile(r"\b(?:I'm|I am)\s+([A-Z][a-z]+)\b(?![-'’])")
+KNOWN_NAMES = frozenset(PATIENT_NAMES)
+
+
+def find_inconsistency(text: str, patient_profile: Dict, end: Optional[int] = None) -> Optional[str]:
+    """Return "age" or "name" if ``text`` contradicts the patient profile, else None.
+
+    Only matches that finish at or before ``end`` count, so a caller scanning
+    a stream can leave matches that may continue in the next chunk for later.
+    """
+    if end is None:
+        end = len(text)
+    for match in AGE_PATTERN.finditer(text):
+        if match.end() <= end and int(match.group(1)) != patient_profile["age"]:
+            return "age"
+    for match in NAME_PATTERN.finditer(text):
+        if match.end() <= end and not patient_profile["name"].startswith(match.group(1)):
+            return "name"
+    for match in SELF_NAME_PATTERN.finditer(text):
+        name = match.group(1)
+        if match.end() <= end and name in KNOWN_NAMES and name != patient_profile["name"]:
+            return "name"
+    return None
+
+
+class InconsistentResponse(Exception):
+    def __init__(self, reason: str):
+        super().__init__(f"Response contradicts the patient's {reason}")
+        self.reason = reason
+
+
+class StreamingConsistencyChecker:
+    """Checks a reply for contradictions of the patient profile as it streams in.
+
+    Each chunk is scanned together with the last ``overlap`` characters seen,
+    so statements split across chunks are still caught. Matches ending in the
+    last ``margin`` characters are left for the next chunk, since they might
+    still grow (e.g. "I'm 4" followed by "5 years old").
+    """
+
+    def __init__(self, patient_profile: Dict, overlap: int = 64, margin: int = 16):
+        self.patient_profile = patient_profile
+        self.overlap = overlap
+        self.margin = margin
+        self._tail = ""
+
+    def feed(self, text: str) -> Optional[str]:
+        window = self._tail + text
+        self._tail = window[-self.overlap:]
+        return find_inconsistency(window, self.patient_profile, len(window) - self.margin)
+
+    def finish(self) -> Optional[str]:
+        return find_inconsistency(self._tail, self.patient_profile)
+
+
+async def checked_deltas(deltas: AsyncIterator[str], checker: StreamingConsistencyChecker) -> AsyncIterator[str]:
+    """Pass text deltas through, raising ``InconsistentResponse`` as soon as one contradicts the profile.
+
+    The contradicting delta itself is not passed on.
+    """
+    async for text in deltas:
+        reason = checker.feed(text)
+        if reason is not None:
+            raise InconsistentResponse(reason)
+        yield text
+    reason = checker.finish()
+    if reason is not None:
+        raise InconsistentResponse(reason)
@@ -0,0 +1,246 @@
+"""Batch evaluation: run scripted interviews against every disorder.
+
+Each interview is a seeded patient for one disorder, asked the same scripted
+interviewer turns a student would type into the web UI. Interviews run in
+parallel on a bounded pool of workers (or, with ``--batch``, one Message
+Batches request per turn), each finished interview is written as one JSON
+line, and a summary of throughput and token spend is printed at the end.
+Run from the repository root:
+
+    python evaluate.py scripts/intake.txt --seeds 3 --workers 8 --out results.jsonl
+    python evaluate.py scripts/intake.txt --offline
+
+``--offline`` uses the fake client from ``benchmarks/`` and needs no API key.
+"""
+import argparse
+import asyncio
+import json
+import os
+import random
+import time
+from types import SimpleNamespace
+from typing import Dict, List, TextIO
+
+import httpx
+from anthropic import AsyncAnthropic
+
+from anthropic_client import ClientManager, create_http_client
+from consistency import find_inconsistency
+from models import disorders
+from prompt_cache import build_cached_request, usage_summary
+from routing import choose_route, routed_stream
+from utils import append_turn, build_user_context, prune_context
+
+BATCH_HEADERS = {"anthropic-beta": "message-batches-2024-09-24,prompt-caching-2024-07-31"}
+TOKEN_TYPES = ("input_tokens", "output_tokens", "cache_read_input_tokens", "cache_creation_input_tokens")
+
+
+def load_script(path: str) -> List[str]:
+    """Interviewer turns, one per line. Blank lines and lines starting with ``#`` are skipped."""
+    with open(path) as script:
+        return [line.strip() for line in script if line.strip() and not line.lstrip().startswith("#")]
+
+
+def new_interview(disorder_name: str, seed: int) -> Dict:
+    context = build_user_context(random.Random(seed), disorder_name)
+    return {
+        "disorder": disorder_name,
+        "seed": seed,
+        "patient_profile": context["patient_profile"],
+        "turns": [],
+        "usage": dict.fromkeys(TOKEN_TYPES, 0),
+        "error": None,
+        "context": context,
+    }
+
+
+def next_request(interview: Dict, question: str) -> Dict:
+    context = interview["context"]
+    return build_cached_request(context["system_message"], context["messages"], question, context["history_summary"])
+
+
+def next_route(interview: Dict) -> Dict:
+    return choose_route(interview["patient_profile"], interview["context"]["turns"])
+
+
+def record_reply(interview: Dict, question: str, reply: str, usage: Dict, route: Dict):
+    context = interview["context"]
+    append_turn(context, question, reply)
+    prune_context(context)
+    interview["turns"].append({
+        "user": question,
+        "assistant": reply,
+        "inconsistency": find_inconsistency(reply, interview["patient_profile"]),
+        "route": route["name"],
+        "model": route["model"],
+        "usage": usage,
+    })
+    for name in TOKEN_TYPES:
+        interview["usage"][name] += usage[name]
+
+
+def write_result(out: TextIO, interview: Dict):
+    record = {key: value for key, value in interview.items() if key != "context"}
+    out.write(json.dumps(record) + "\n")
+    out.flush()
+
+
+async def run_interview(manager: ClientManager, interview: Dict, script: List[str]):
+    for question in script:
+        request = next_request(interview, question)
+        async with routed_stream(manager, next_route(interview), request) as (route, deltas, stream):
+            reply = "".join([text async for text in deltas])
+            final_message = await stream.get_final_message()
+        record_reply(interview, question, reply, usage_summary(final_message.usage), route)
+
+
+async def run_streaming(manager: ClientManager, interviews: List[Dict], script: List[str], workers: int, out: TextIO):
+    """Run interviews on ``workers`` concurrent workers, writing each one as soon as it finishes."""
+    queue: asyncio.Queue = asyncio.Queue()
+    for interview in interviews:
+        queue.put_nowait(interview)
+
+    async def worker():
+        while not queue.empty():
+            interview = queue.get_nowait()
+            start = time.perf_counter()
+            try:
+                await run_interview(manager, interview, script)
+            except Exception as e:
+                interview["error"] = f"{type(e).__name__}: {e}"
+            interview["elapsed_s"] = round(time.perf_counter() - start, 3)
+            write_result(out, interview)
+
+    await asyncio.gather(*(worker() for _ in range(workers)))
+
+
+async def run_batch(client: AsyncAnthropic, requests: List[Dict], poll_interval: float) -> Dict[str, Dict]:
+    """Submit one Message Batches request and wait for it, returning results by ``custom_id``.
+
+    The pinned SDK predates the batches endpoints, so they are called directly.
+    """
+    options = {"headers": BATCH_HEADERS}
+    response = await client.post(
+        "/v1/messages/batches", body={"requests": requests}, cast_to=httpx.Response, options=options
+    )
+    batch = response.json()
+    while batch["processing_status"] != "ended":
+        await asyncio.sleep(poll_interval)
+        response = await client.get(f"/v1/messages/batches/{batch['id']}", cast_to=httpx.Response, options=options)
+        batch = response.json()
+    response = await client.get(
+        f"/v1/messages/batches/{batch['id']}/results", cast_to=httpx.Response, options=options
+    )
+    results = (json.loads(line) for line in response.text.splitlines() if line.strip())
+    return {result["custom_id"]: result["result"] for result in results}
+
+
+async def run_batches(client: AsyncAnthropic, interviews: List[Dict], script: List[str], poll_interval: float, out: TextIO):
+    """Run every interview turn by turn, sending turn N of all interviews as one batch."""
+    start = time.perf_counter()
+    for question in script:
+        live = {str(n): interview for n, interview in enumerate(interviews) if interview["error"] is None}
+        if not live:
+            break
+        requests = []
+        routes = {}
+        for custom_id, interview in live.items():
+            request = next_request(interview, question)
+            request.pop("extra_headers")
+            route = routes[custom_id] = next_route(interview)
+            requests.append({
+                "custom_id": custom_id,
+                "params": {"model": route["model"], "max_tokens": route["max_tokens"], **request},
+            })
+        results = await run_batch(client, requests, poll_interval)
+        for custom_id, interview in live.items():
+            result = results.get(custom_id, {"type": "missing"})
+            if result["type"] != "succeeded":
+                interview["error"] = f"batch result {result['type']}: {result.get('error')}"
+                continue
+            message = result["message"]
+            reply = "".join(block["text"] for block in message["content"] if block["type"] == "text")
+            record_reply(interview, question, reply, usage_summary(SimpleNamespace(**message["usage"])), routes[custom_id])
+    elapsed = round(time.perf_counter() - start, 3)
+    for interview in interviews:
+        interview["elapsed_s"] = elapsed
+        write_result(out, interview)
+
+
+def summarize(interviews: List[Dict], elapsed: float) -> Dict:
+    turns = sum(len(interview["turns"]) for interview in interviews)
+    usage = {name: sum(interview["usage"][name] for interview in interviews) for name in TOKEN_TYPES}
+    return {
+        "interviews": len(interviews),
+        "errors": sum(interview["error"] is not None for interview in interviews),
+        "turns": turns,
+        "inconsistent_turns": sum(
+            turn["inconsistency"] is not None for interview in interviews for turn in interview["turns"]
+        ),
+        "elapsed_s": round(elapsed, 3),
+        "interviews_per_s": round(len(interviews) / elapsed, 2),
+        "turns_per_s": round(turns / elapsed, 2),
+        "usage": usage,
+    }
+
+
+async def run(args) -> Dict:
+    script = load_script(args.script)
+    disorder_names = args.disorder or list(disorders)
+    interviews = [
+        new_interview(name, seed) for name in disorder_names for seed in range(args.first_seed, args.first_seed + args.seeds)
+    ]
+
+    if args.offline:
+        from benchmarks.fake_anthropic import FakeAsyncAnthropic
+        client = FakeAsyncAnthropic(ttft=0.05, tokens_per_sec=0, reply_length=40)
+    else:
+        client = AsyncAnthropic(http_client=create_http_client(), max_retries=0)
+
+    start = time.perf_counter()
+    try:
+        with open(args.out, "w") as out:
+            if args.batch:
+                await run_batches(client, interviews, script, args.poll_interval, out)
+            else:
+                manager = ClientManager(client, max_concurrent=args.workers)
+                await run_streaming(manager, interviews, script, args.workers, out)
+    finally:
+        await client.close()
+    return summarize(interviews, time.perf_counter() - start)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("script", help="File of interviewer turns, one per line")
+    parser.add_argument("--seeds", type=int, default=1, help="Patients per disorder")
+    parser.add_argument("--first-seed", type=int, default=0, help="Seed of the first patient for each disorder")
+    parser.add_argument("--disorder", action="append", choices=list(disorders), help="Only this disorder (repeatable)")
+    parser.add_argument("--workers", type=int, default=8, help="Interviews run at the same time")
+    parser.add_argument("--batch", action="store_true", help="Use the Message Batches API instead of streaming")
+    parser.add_argument("--poll-interval", type=float, default=30.0, help="Seconds between batch status checks")
+    parser.add_argument("--out", default="evaluation.jsonl", help="JSONL file for the finished interviews")
+    parser.add_argument("--offline", action="store_true", help="Use a fake client instead of the API")
+    parser.add_argument("--json", action="store_true", help="Print the summary as JSON")
+    args = parser.parse_args()
+    if args.offline and args.batch:
+        parser.error("--batch needs the real API")
+    if not args.offline and not os.getenv("ANTHROPIC_API_KEY"):
+        parser.error("ANTHROPIC_API_KEY is not set (use --offline to run without it)")
+
+    summary = asyncio.run(run(args))
+    if args.json:
+        print(json.dumps(summary))
+        return
+    print(f"interviews={summary['interviews']} turns={summary['turns']} errors={summary['errors']} "
+          f"inconsistent_turns={summary['inconsistent_turns']}")
+    print(f"throughput: {summary['interviews_per_s']} interviews/s, {summary['turns_per_s']} turns/s "
+          f"over {summary['elapsed_s']} s")
+    usage = summary["usage"]
+    print(f"tokens: input={usage['input_tokens']} output={usage['output_tokens']} "
+          f"cache_read={usage['cache_read_input_tokens']} cache_creation={usage['cache_creation_input_tokens']}")
+    print(f"results written to {args.out}")
+
+
+if __name__ == "__main__":
+    main()
@@ -1,22 +1,65 @@
 import os
-import uvicorn
 from fastapi import FastAPI
+from contextlib import asynccontextmanager
 from anthropic_client import lifespan
+from models import transcript_log, response_cache
 from routes import app_routes
+from utils import profile_pool
 from fastapi.staticfiles import StaticFiles
 
 
-app = FastAPI(lifespan=lifespan)
+@asynccontextmanager
+async def app_lifespan(app: FastAPI):
+    async with lifespan(app):
+        # Build the first patients while the server starts taking requests, without delaying startup
+        profile_pool.start()
+        yield
+        profile_pool.stop()
+        # Write out any transcript records still waiting in the write-behind queue
+        await transcript_log.close()
+        if response_cache is not None:
+            response_cache.close()
+
+
+app = FastAPI(lifespan=app_lifespan)
 app.mount("/static", StaticFiles(directory="static"), name="static")
 app.include_router(app_routes)
 
 if __name__ == "__main__":
     import argparse
+    import uvicorn
 
     parser = argparse.ArgumentParser(description="Run the FastAPI server with Anthropic API key")
     parser.add_argument("--api-key", required=True, help="Anthropic API key")
+    parser.add_argument("--host", default="0.0.0.0", help="Interface to bind")
+    parser.add_argument("--port", type=int, default=8000, help="Port to bind")
+    parser.add_argument(
+        "--production",
+        action="store_true",
+        help="Run without auto-reload, with --workers processes sharing one session store",
+    )
+    parser.add_argument("--workers", type=int, default=1, help="Number of worker processes (production only)")
+    parser.add_argument(
+        "--session-db",
+        default="sessions.db",
+        help="SQLite file shared by all workers when running more than one",
+    )
     args = parser.parse_args()
 
+    if args.production and not os.getenv("THERABOT_SESSION_SECRET"):
+        # A generated key only lives on this host; a deployment has to keep the same one
+        # across releases and machines, or every student's session is rejected on restart
+        parser.error("THERABOT_SESSION_SECRET must be set in production")
+
     os.environ["ANTHROPIC_API_KEY"] = args.api_key
 
-    uvicorn.run("main:app", host="0.0.0.0", port=8000, reload=True)
+    if args.production:
+        if args.workers > 1 and os.getenv("THERABOT_SESSION_BACKEND", "memory") == "memory":
+            # Workers are separate processes, so in-memory sessions would not be visible
+            # to a request routed to another worker. Share them through SQLite instead.
+            os.environ["THERABOT_SESSION_BACKEND"] = "sqlite"
+            os.environ.setdefault("THERABOT_SESSION_DB_PATH", args.session_db)
+            print(f"Using shared SQLite session store at {os.environ['THERABOT_SESSION_DB_PATH']}")
+        uvicorn.run("main:app", host=args.host, port=args.port, workers=args.workers)
+    else:
+        uvicorn.run("main:app", host=args.host, port=args.port, reload=True)
@@ -0,0 +1,222 @@
+import json
+import time
+from bisect import bisect_left
+from typing import Callable, Dict, List, Optional, Sequence, Tuple
+
+DEFAULT_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0)
+
+registry: List["Metric"] = []
+
+
+def _format_labels(names: Sequence[str], values: Tuple, extra: str = "") -> str:
+    pairs = [f'{name}="{value}"' for name, value in zip(names, values)]
+    if extra:
+        pairs.append(extra)
+    return "{" + ",".join(pairs) + "}" if pairs else ""
+
+
+class Metric:
+    type = ""
+
+    def __init__(self, name: str, help: str, labelnames: Sequence[str] = ()):
+        self.name = name
+        self.help = help
+        self.labelnames = tuple(labelnames)
+        registry.append(self)
+
+    def _key(self, labels: Dict[str, str]) -> Tuple:
+        return tuple(labels.get(name, "") for name in self.labelnames)
+
+    def samples(self) -> List[str]:
+        raise NotImplementedError
+
+    def render(self) -> str:
+        lines = [f"# HELP {self.name} {self.help}", f"# TYPE {self.name} {self.type}"]
+        lines.extend(self.samples())
+        return "\n".join(lines)
+
+
+class Counter(Metric):
+    type = "counter"
+
+    def __init__(self, name: str, help: str, labelnames: Sequence[str] = ()):
+        super().__init__(name, help, labelnames)
+        self._values: Dict[Tuple, float] = {}
+
+    def inc(self, amount: float = 1, **labels):
+        key = self._key(labels)
+        self._values[key] = self._values.get(key, 0) + amount
+
+    def value(self, **labels) -> float:
+        return self._values.get(self._key(labels), 0)
+
+    def samples(self):
+        return [f"{self.name}{_format_labels(self.labelnames, key)} {value}" for key, value in self._values.items()]
+
+
+class Gauge(Metric):
+    """A gauge set directly, or read from ``function`` at scrape time."""
+
+    type = "gauge"
+
+    def __init__(self, name: str, help: str, function: Optional[Callable[[], float]] = None):
+        super().__init__(name, help)
+        self.function = function
+        self._value = 0.0
+
+    def inc(self, amount: float = 1):
+        self._value += amount
+
+    def dec(self, amount: float = 1):
+        self._value -= amount
+
+    def set(self, value: float):
+        self._value = value
+
+    def value(self) -> float:
+        return self.function() if self.function is not None else self._value
+
+    def samples(self):
+        return [f"{self.name} {self.value()}"]
+
+
+class Histogram(Metric):
+    type = "histogram"
+
+    def __init__(self, name: str, help: str, labelnames: Sequence[str] = (), buckets: Sequence[float] = DEFAULT_BUCKETS):
+        super().__init__(name, help, labelnames)
+        self.buckets = tuple(buckets)
+        # label values -> [per-bucket counts (+Inf last), sum, count]
+        self._values: Dict[Tuple, list] = {}
+
+    def observe(self, value: float, **labels):
+        key = self._key(labels)
+        entry = self._values.get(key)
+        if entry is None:
+            entry = self._values[key] = [[0] * (len(self.buckets) + 1), 0.0, 0]
+        entry[0][bisect_left(self.buckets, value)] += 1
+        entry[1] += value
+        entry[2] += 1
+
+    def samples(self):
+        lines = []
+        for key, (counts, total, count) in self._values.items():
+            cumulative = 0
+            for bound, bucket_count in zip((*self.buckets, "+Inf"), counts):
+                cumulative += bucket_count
+                le = f'le="{bound}"'
+                lines.append(f"{self.name}_bucket{_format_labels(self.labelnames, key, le)} {cumulative}")
+            lines.append(f"{self.name}_sum{_format_labels(self.labelnames, key)} {total}")
+            lines.append(f"{self.name}_count{_format_labels(self.labelnames, key)} {count}")
+        return lines
+
+
+def render_metrics() -> str:
+    """All registered metrics in the Prometheus text exposition format."""
+    return "\n".join(metric.render() for metric in registry) + "\n"
+
+
+class RequestTimer:
+    """Splits a request into consecutive phases. ``lap`` ends the current phase."""
+
+    __slots__ = ("start", "last", "phases")
+
+    def __init__(self):
+        self.start = self.last = time.perf_counter()
+        self.phases: Dict[str, float] = {}
+
+    def lap(self, phase: str):
+        now = time.perf_counter()
+        self.phases[phase] = now - self.last
+        self.last = now
+
+    def total(self) -> float:
+        return time.perf_counter() - self.start
+
+
+def log_event(event: str, **fields):
+    """Write one structured log line as JSON."""
+    print(json.dumps({"event": event, "ts": round(time.time(), 3), **fields}), flush=True)
+
+
+CHAT_REQUESTS = Counter("therabot_chat_requests_total", "Chat requests by outcome", ("outcome",))
+CHAT_PHASE_SECONDS = Histogram("therabot_chat_phase_seconds", "Time spent in each phase of a chat request", ("phase",))
+CHAT_SECONDS = Histogram("therabot_chat_seconds", "Total chat request time, including streaming")
+SSE_BYTES = Counter("therabot_sse_bytes_total", "Bytes of SSE frames written to clients")
+SSE_FRAMES = Counter("therabot_sse_frames_total", "SSE frames written to clients")
+TOKENS = Counter("therabot_tokens_total", "Model tokens by type", ("type",))
+CONSISTENCY_CORRECTIONS = Counter(
+    "therabot_consistency_corrections_total", "Replies cut short and corrected for contradicting the profile", ("reason",)
+)
+ABORTED_STREAMS = Counter("therabot_aborted_streams_total", "Upstream streams closed early because the client disconnected")
+SAVED_OUTPUT_TOKENS = Counter(
+    "therabot_saved_output_tokens_total", "Estimated output tokens not generated thanks to closing streams early"
+)
+RESPONSE_CACHE_LOOKUPS = Counter(
+    "therabot_response_cache_lookups_total", "Response cache lookups by result (memory, disk or miss)", ("result",)
+)
+RATE_LIMITED = Counter("therabot_rate_limited_total", "Chat requests turned away by a rate limit", ("scope",))
+CHAT_ROUTES = Counter("therabot_chat_routes_total", "Chat turns by the route and model that served them", ("route", "model"))
+ROUTE_FALLBACKS = Counter(
+    "therabot_route_fallbacks_total", "Turns moved to the fallback model, by reason (overloaded or slow)", ("reason",)
+)
+SESSIONS_CREATED = Counter("therabot_sessions_created_total", "Sessions started with /new-context")
+ACTIVE_STREAMS = Gauge("therabot_active_streams", "Chat responses currently streaming")
+# Set by the /metrics handler, since counting sessions may hit disk
+ACTIVE_SESSIONS = Gauge("therabot_active_sessions", "Sessions held by the session store")
+
+
+def observe_chat(
+    timer: RequestTimer,
+    outcome: str,
+    sse_bytes: int,
+    sse_frames: int,
+    usage: Optional[Dict] = None,
+    cached: bool = False,
+    route: Optional[Dict] = None,
+):
+    """Record a finished chat request: phase timings, bytes written, token usage and a log line."""
+    total = timer.total()
+    CHAT_REQUESTS.inc(outcome=outcome)
+    CHAT_SECONDS.observe(total)
+    for phase, seconds in timer.phases.items():
+        CHAT_PHASE_SECONDS.observe(seconds, phase=phase)
+    SSE_BYTES.inc(sse_bytes)
+    SSE_FRAMES.inc(sse_frames)
+    if route:
+        CHAT_ROUTES.inc(route=route["name"], model=route["model"])
+    if usage:
+        TOKENS.inc(usage["input_tokens"], type="input")
+        TOKENS.inc(usage["output_tokens"], type="output")
+        TOKENS.inc(usage["cache_read_input_tokens"], type="cache_read")
+        TOKENS.inc(usage["cache_creation_input_tokens"], type="cache_creation")
+    log_event(
+        "chat",
+        outcome=outcome,
+        total_ms=round(total * 1000, 1),
+        phases_ms={phase: round(seconds * 1000, 1) for phase, seconds in timer.phases.items()},
+        sse_bytes=sse_bytes,
+        sse_frames=sse_frames,
+        usage=usage,
+        cached=cached,
+        route=route,
+    )
+
+
+# Assumed length of a patient reply until a completed reply gives a real average
+TYPICAL_REPLY_TOKENS = 150
+
+
+def observe_aborted_stream(streamed_tokens: int, max_tokens: int):
+    """Record a stream closed on client disconnect.
+
+    The tokens saved are estimated as the average output of completed replies
+    (``TYPICAL_REPLY_TOKENS`` before there are any, capped at ``max_tokens``)
+    minus what had already been streamed.
+    """
+    ABORTED_STREAMS.inc()
+    completed = CHAT_REQUESTS.value(outcome="ok")
+    expected = TOKENS.value(type="output") / completed if completed else TYPICAL_REPLY_TOKENS
+    saved = max(min(expected, max_tokens) - streamed_tokens, 0)
+    SAVED_OUTPUT_TOKENS.inc(round(saved))
+    log_event("stream_aborted", streamed_tokens=streamed_tokens, saved_tokens_estimate=round(saved))
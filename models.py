@@ -1,14 +1,129 @@
-from typing import Dict
+import os
 from fastapi.templating import Jinja2Templates
+from session_store import SessionStore, create_session_store
+from session_tokens import load_or_create_secret
+from transcripts import TranscriptLog
+from response_cache import ResponseCache
+from scheduler import RateLimiter
 
-MAX_CONTEXT_LENGTH = 20
-user_contexts: Dict[str, Dict] = {}
+# Model routing. The first ROUTE_EARLY_TURNS turns of an interview (short, guarded
+# rapport-building replies) go to FAST_MODEL with at most FAST_MAX_REPLY_TOKENS; later turns
+# go to CHAT_MODEL. A CHAT_MODEL turn falls back to FAST_MODEL when the API is overloaded or
+# no text has arrived within TTFT_SLO seconds (0 disables). Disorders can override the
+# turn count and reply lengths with a "routing" entry. An empty FAST_MODEL disables routing.
+CHAT_MODEL = os.getenv("THERABOT_CHAT_MODEL", "claude-3-sonnet-20240229")
+MAX_REPLY_TOKENS = int(os.getenv("THERABOT_MAX_REPLY_TOKENS", "1000"))
+FAST_MODEL = os.getenv("THERABOT_FAST_MODEL", "claude-3-haiku-20240307")
+FAST_MAX_REPLY_TOKENS = int(os.getenv("THERABOT_FAST_MAX_REPLY_TOKENS", "300"))
+ROUTE_EARLY_TURNS = int(os.getenv("THERABOT_ROUTE_EARLY_TURNS", "3"))
+TTFT_SLO = float(os.getenv("THERABOT_TTFT_SLO", "4"))
+
+# Conversation history sent to the model is pruned to roughly this many tokens. With
+# SUMMARIZE_PRUNED_TURNS, dropped turns are folded into a short rolling summary instead.
+# Once over budget, history is cut down to PRUNE_TARGET of it in one step, so the cached
+# prompt prefix then stays unchanged for many turns instead of shifting every turn.
+MAX_CONTEXT_TOKENS = int(os.getenv("THERABOT_MAX_CONTEXT_TOKENS", "6000"))
+PRUNE_TARGET = float(os.getenv("THERABOT_PRUNE_TARGET", "0.6"))
+SUMMARY_MAX_TOKENS = int(os.getenv("THERABOT_SUMMARY_MAX_TOKENS", "400"))
+SUMMARIZE_PRUNED_TURNS = os.getenv("THERABOT_SUMMARIZE_PRUNED_TURNS", "1") == "1"
+
+# Session storage. Idle sessions are evicted after SESSION_IDLE_TTL seconds or when the
+# count/byte limits are hit; with SESSION_DB_PATH set they are spilled to SQLite instead.
+SESSION_BACKEND = os.getenv("THERABOT_SESSION_BACKEND", "memory")
+SESSION_MAX_COUNT = int(os.getenv("THERABOT_SESSION_MAX_COUNT", "1000"))
+SESSION_MAX_BYTES = int(os.getenv("THERABOT_SESSION_MAX_BYTES", str(64 * 1024 * 1024)))
+SESSION_IDLE_TTL = float(os.getenv("THERABOT_SESSION_IDLE_TTL", str(2 * 60 * 60)))
+SESSION_DB_PATH = os.getenv("THERABOT_SESSION_DB_PATH")
+# The in-memory store can be split into this many shards, each with its own lock and an
+# even share of the limits. Hash imbalance makes shards evict early, so the default is 1.
+SESSION_SHARDS = int(os.getenv("THERABOT_SESSION_SHARDS", "1"))
+
+# Session IDs are signed with this key so forged cookies are rejected without a store lookup.
+# Without THERABOT_SESSION_SECRET, a key is generated on first run and kept in
+# SESSION_SECRET_PATH (next to the transcript log), so sessions survive restarts and every
+# worker on the host signs with the same key.
+SESSION_SECRET_PATH = os.getenv(
+    "THERABOT_SESSION_SECRET_PATH",
+    os.path.join(os.path.dirname(os.getenv("THERABOT_TRANSCRIPT_DB_PATH", "transcripts.db")), "session_secret"),
+)
+SESSION_SECRET = (
+    os.environ["THERABOT_SESSION_SECRET"].encode()
+    if os.getenv("THERABOT_SESSION_SECRET")
+    else load_or_create_secret(SESSION_SECRET_PATH)
+)
+
+# SSE streaming: text deltas are coalesced into one frame until STREAM_FLUSH_CHARS characters
+# or STREAM_FLUSH_INTERVAL seconds have built up; a keep-alive comment is sent after
+# STREAM_KEEPALIVE_INTERVAL seconds without output.
+STREAM_FLUSH_INTERVAL = float(os.getenv("THERABOT_STREAM_FLUSH_INTERVAL", "0.05"))
+STREAM_FLUSH_CHARS = int(os.getenv("THERABOT_STREAM_FLUSH_CHARS", "200"))
+STREAM_KEEPALIVE_INTERVAL = float(os.getenv("THERABOT_STREAM_KEEPALIVE_INTERVAL", "15"))
+
+# Check replies for contradictions of the patient's age or name while they stream, and
+# replace them with a corrected reply as soon as one is spotted
+CONSISTENCY_CHECK = os.getenv("THERABOT_CONSISTENCY_CHECK", "1") == "1"
+
+# When a student disconnects mid-reply the upstream stream is closed; the partial reply is
+# kept in the session (marked as interrupted) unless this is disabled
+KEEP_PARTIAL_REPLIES = os.getenv("THERABOT_KEEP_PARTIAL_REPLIES", "1") == "1"
+
+# Per-session and per-client-IP token buckets for /chat, in turns per minute with a burst
+# allowance. A whole classroom may share one IP, so its limit is much looser; 0 disables.
+SESSION_TURNS_PER_MINUTE = float(os.getenv("THERABOT_SESSION_TURNS_PER_MINUTE", "10"))
+SESSION_TURN_BURST = float(os.getenv("THERABOT_SESSION_TURN_BURST", "5"))
+IP_TURNS_PER_MINUTE = float(os.getenv("THERABOT_IP_TURNS_PER_MINUTE", "300"))
+IP_TURN_BURST = float(os.getenv("THERABOT_IP_TURN_BURST", "60"))
+session_limiter = RateLimiter(SESSION_TURNS_PER_MINUTE / 60, SESSION_TURN_BURST)
+ip_limiter = RateLimiter(IP_TURNS_PER_MINUTE / 60, IP_TURN_BURST)
+
+# Prompt templates compiled ahead of time by precompile.py; compiled at import when missing
+PRECOMPILED_TEMPLATES_PATH = os.getenv("THERABOT_PRECOMPILED_TEMPLATES_PATH", "precompiled_templates.bin")
+
+# Pool of pre-generated patient contexts served by /new-context. Set PROFILE_POOL_SEED
+# to make the sequence of patients reproducible.
+PROFILE_POOL_SIZE = int(os.getenv("THERABOT_PROFILE_POOL_SIZE", "32"))
+PROFILE_POOL_SEED = int(os.environ["THERABOT_PROFILE_POOL_SEED"]) if os.getenv("THERABOT_PROFILE_POOL_SEED") else None
+
+user_contexts: SessionStore = create_session_store(
+    SESSION_BACKEND,
+    max_sessions=SESSION_MAX_COUNT,
+    max_bytes=SESSION_MAX_BYTES,
+    idle_ttl=SESSION_IDLE_TTL,
+    db_path=SESSION_DB_PATH,
+    shards=SESSION_SHARDS,
+)
 templates = Jinja2Templates(directory="templates")
 
+# Every session and completed turn is logged here in the background, so sessions can be
+# rehydrated after a restart. TRANSCRIPT_FLUSH_INTERVAL is the write-behind delay in seconds.
+TRANSCRIPT_DB_PATH = os.getenv("THERABOT_TRANSCRIPT_DB_PATH", "transcripts.db")
+TRANSCRIPT_FLUSH_INTERVAL = float(os.getenv("THERABOT_TRANSCRIPT_FLUSH_INTERVAL", "0.5"))
+transcript_log = TranscriptLog(TRANSCRIPT_DB_PATH, flush_interval=TRANSCRIPT_FLUSH_INTERVAL)
+
+# Opt-in cache of completed replies keyed by model, system prompt and history, so replays of
+# a seeded patient with scripted questions (e.g. instructor demos) skip the API. Hits are
+# replayed at RESPONSE_CACHE_REPLAY_RATE words per second (0 sends them at once).
+RESPONSE_CACHE = os.getenv("THERABOT_RESPONSE_CACHE", "0") == "1"
+RESPONSE_CACHE_SIZE = int(os.getenv("THERABOT_RESPONSE_CACHE_SIZE", "256"))
+RESPONSE_CACHE_DB_PATH = os.getenv("THERABOT_RESPONSE_CACHE_DB_PATH", "responses.db")
+RESPONSE_CACHE_REPLAY_RATE = float(os.getenv("THERABOT_RESPONSE_CACHE_REPLAY_RATE", "0"))
+response_cache = ResponseCache(RESPONSE_CACHE_SIZE, RESPONSE_CACHE_DB_PATH or None) if RESPONSE_CACHE else None
+
+PATIENT_NAMES = (
+    "Alex", "Jordan", "Taylor", "Casey", "Riley", "Morgan", "Jamie", "Cameron", "Avery",
+    "Quinn", "Skylar", "Charlie", "Frankie", "Finley", "Emerson", "Sage", "Remy", "Parker",
+    "Hayden", "Drew", "Phoenix", "River", "Sawyer", "Rowan", "Blair", "Kendall", "Marlowe",
+    "Harper", "Reese", "Dakota", "Jadin", "Ash", "Casey", "Ainsley", "Ariel", "Angel", "Addison",
+    "Aspen", "Deven", "Julian", "Jesse", "Terry", "London", "Max", "Morgan", "Noel", "Pat",
+    "Peyton", "Ray", "Reagan", "Riley", "Roan", "Sam", "Shae", "Tate", "Tony",
+)
+
 disorders = {
     # Neurodevelopmental Disorders
     "Autism Spectrum Disorder": {
         "age_range": (12, 15),
+        "reminder": "You may struggle with social situations, changes in routine, and have intense interests in specific topics.",
+        "self_description": "I've been having a hard time in social situations and dealing with changes. Sometimes I get really focused on certain topics or routines.",
         "symptoms": [
             "difficulty with social interactions",
             "challenges in communication",
@@ -19,6 +134,8 @@ disorders = {
     },
     "Attention-Deficit/Hyperactivity Disorder (ADHD)": {
         "age_range": (12, 40),
+        "reminder": "You may have trouble staying focused, lose track of things, interrupt or act on impulse, and feel restless when you have to sit still.",
+        "self_description": "I have a really hard time keeping my focus, I lose track of things all the time, and I tend to act before I think.",
         "symptoms": [
             "difficulty sustaining attention in tasks",
             "impulsivity and acting without thinking",
@@ -31,6 +148,8 @@ disorders = {
     # Disruptive, Impulse Control, and Conduct Disorders
     "Oppositional Defiant Disorder": {
         "age_range": (12, 18),
+        "reminder": "You may feel irritated by people telling you what to do, argue back quickly, and feel that others are to blame when things go wrong.",
+        "self_description": "I get really angry when people boss me around, and I end up arguing with them a lot.",
         "symptoms": [
             "frequent temper tantrums or anger outbursts",
             "arguing with authority figures",
@@ -41,6 +160,8 @@ disorders = {
     },
     "Antisocial Personality Disorder": {
         "age_range": (18, 65),
+        "reminder": "You may see rules as things that get in your way, act on impulse, and not feel especially bad about how your actions affect other people.",
+        "self_description": "People keep telling me I've got problems with rules and with how I treat others, and I've been in some trouble because of it.",
         "symptoms": [
             "disregard for the rights of others",
             "repeated violation of societal norms and laws",
@@ -53,6 +174,10 @@ disorders = {
     # Schizophrenia Spectrum and Other Psychotic Disorders
     "Schizophrenia with Paranoid Delusions": {
         "age_range": (18, 65),
+        "reminder": "You may feel that others are watching or plotting against you, hear or see things others don't, and find it hard to keep your thoughts in order.",
+        "self_description": "I've been feeling like people are out to get me, and sometimes I hear or see things that are hard to explain.",
+        # Disorganized speech is hard to keep coherent; use the stronger model from the start
+        "routing": {"early_turns": 0},
         "symptoms": [
             "persistent delusions, particularly of persecution",
             "auditory or visual hallucinations",
@@ -65,6 +190,8 @@ disorders = {
     # Bipolar and Related Disorders
     "Bipolar Disorder": {
         "age_range": (18, 65),
+        "reminder": "You may go through stretches of feeling unusually energetic, restless and full of ideas, and other stretches of feeling very low and drained.",
+        "self_description": "My moods have been all over the place. Sometimes I feel like I can do anything, and other times I can barely get out of bed.",
         "symptoms": [
             "extreme mood swings from high energy to low energy",
             "periods of elevated mood (mania) with increased activity",
@@ -77,6 +204,10 @@ disorders = {
     # Depressive Disorders
     "Major Depressive Disorder": {
         "age_range": (18, 65),
+        "reminder": "You may feel persistently sad, lack energy and motivation, and have difficulty finding joy in activities.",
+        "self_description": "I've been feeling really down lately, and I'm having trouble finding energy or interest in things I used to enjoy.",
+        # Withdrawn patients keep their answers brief for longer
+        "routing": {"early_turns": 5, "fast_max_tokens": 200},
         "symptoms": [
             "persistent feelings of sadness",
             "loss of interest in activities",
@@ -87,6 +218,8 @@ disorders = {
     },
     "Persistent Depressive Disorder (Dysthymia)": {
         "age_range": (18, 65),
+        "reminder": "You may have felt low and flat for so long that it seems like just who you are, with little energy and a poor view of yourself.",
+        "self_description": "I've felt kind of low and tired for a long time now, so long that it just feels normal for me.",
         "symptoms": [
             "long-term (2+ years) low mood",
             "lack of energy and motivation",
@@ -99,6 +232,8 @@ disorders = {
     # Anxiety Disorders
     "Generalized Anxiety Disorder (GAD)": {
         "age_range": (18, 65),
+        "reminder": "You may worry constantly about many everyday things, find it hard to switch the worry off, and feel tense, tired or on edge.",
+        "self_description": "I worry about pretty much everything, and I can't seem to turn it off. I'm tense and tired most of the time.",
         "symptoms": [
             "excessive worry about various aspects of life",
             "restlessness or feeling on edge",
@@ -109,6 +244,8 @@ disorders = {
     },
     "Panic Disorder": {
         "age_range": (18, 50),
+        "reminder": "You may have had sudden attacks of intense fear with a racing heart and trouble breathing, and now worry about the next one happening.",
+        "self_description": "I've been having these sudden episodes where my heart races and I can't breathe, and now I'm scared of the next one.",
         "symptoms": [
             "unexpected panic attacks",
             "intense fear or discomfort during attacks",
@@ -121,6 +258,8 @@ disorders = {
     # Obsessive-Compulsive and Related Disorders
     "Obsessive-Compulsive Disorder (OCD)": {
         "age_range": (12, 50),
+        "reminder": "You may have unwanted, distressing thoughts that keep coming back and feel you have to do certain things over and over to feel okay.",
+        "self_description": "I keep getting thoughts I can't shake, and I feel like I have to do certain things over and over to make them stop.",
         "symptoms": [
             "recurrent, intrusive thoughts or images (obsessions)",
             "repetitive behaviors or rituals (compulsions)",
@@ -133,6 +272,8 @@ disorders = {
     # Trauma- and Stressor-Related Disorders
     "Post-Traumatic Stress Disorder (PTSD)": {
         "age_range": (18, 65),
+        "reminder": "You may relive something terrible that happened to you, avoid reminders of it, and feel jumpy or on guard much of the time.",
+        "self_description": "Something bad happened to me, and I keep reliving it. I'm on edge a lot and I try to avoid anything that reminds me of it.",
         "symptoms": [
             "recurrent distressing memories or flashbacks of trauma",
             "avoidance of reminders associated with the trauma",
@@ -143,6 +284,8 @@ disorders = {
     },
     "Acute Stress Disorder": {
         "age_range": (18, 65),
+        "reminder": "You recently went through something frightening and may keep replaying it, feel numb or unreal, and have trouble sleeping or relaxing.",
+        "self_description": "Something scary happened recently, and since then I can't stop replaying it or sleep properly. Things feel kind of unreal.",
         "symptoms": [
             "severe anxiety after a traumatic event",
             "recurrent distressing dreams or flashbacks",
@@ -155,6 +298,10 @@ disorders = {
     # Dissociative Disorders
     "Dissociative Identity Disorder (DID)": {
         "age_range": (18, 65),
+        "reminder": "You may lose track of time, find evidence of things you don't remember doing, and sometimes feel like you are not yourself.",
+        "self_description": "I keep losing chunks of time, and sometimes I find things I don't remember doing. It's like I'm not always myself.",
+        # Shifts between personality states need the stronger model throughout
+        "routing": {"early_turns": 0},
         "symptoms": [
             "presence of two or more distinct personality states",
             "gaps in memory for everyday events or personal information",
@@ -165,6 +312,8 @@ disorders = {
     },
     "Dissociative Amnesia": {
         "age_range": (18, 65),
+        "reminder": "You may have gaps in your memory about important parts of your life and feel confused or distressed when you try to remember.",
+        "self_description": "There are big parts of my life I just can't remember, and trying to remember makes me really upset.",
         "symptoms": [
             "inability to recall important personal information",
             "memory loss that is inconsistent with normal forgetting",
@@ -177,6 +326,8 @@ disorders = {
     # Substance Abuse and Addictive Disorders
     "Substance-Induced Psychotic Disorder, Opioid Use Disorder and Violence": {
         "age_range": (18, 65),
+        "reminder": "You may feel a strong pull to use opioids, feel sick without them, get suspicious of people, and sometimes lose your temper badly.",
+        "self_description": "I've been using and it's hard to stop. I feel sick without it, I get suspicious of people, and sometimes I lose my temper.",
         "symptoms": [
             "paranoia and delusions related to substance use",
             "aggressive or violent outbursts",
@@ -187,6 +338,8 @@ disorders = {
     },
     "Alcohol Use Disorder": {
         "age_range": (18, 65),
+        "reminder": "You may find it hard to control how much you drink, crave alcohol, and keep drinking even when it causes problems for you.",
+        "self_description": "My drinking has been getting out of hand. I keep meaning to cut back, but I don't manage it, and it's causing problems.",
         "symptoms": [
             "difficulty controlling drinking behavior",
             "cravings for alcohol",
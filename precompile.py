@@ -0,0 +1,28 @@
+"""Write the precompiled prompt templates loaded at startup.
+
+Run from the repository root after changing the templates in ``prompts.py``
+(or upgrading Python or Jinja2), e.g. as a step of the container build:
+
+    python precompile.py
+
+A missing or out-of-date artifact is not an error: the templates are then
+compiled at import as usual.
+"""
+import argparse
+import time
+
+from models import PRECOMPILED_TEMPLATES_PATH
+from prompts import write_precompiled
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--out", default=PRECOMPILED_TEMPLATES_PATH, help="Artifact to write")
+    args = parser.parse_args()
+    start = time.perf_counter()
+    write_precompiled(args.out)
+    print(f"wrote {args.out} in {(time.perf_counter() - start) * 1000:.1f} ms")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,61 @@
+import asyncio
+import random
+from collections import deque
+from typing import Callable, Dict, Optional
+
+
+class ProfilePool:
+    """Ready-made session contexts (patient profile plus rendered prompt) for ``/new-context``.
+
+    ``take`` pops a context in O(1) and, once the pool drops below half full,
+    schedules a background task that refills it one context at a time between
+    other work on the event loop; ``start`` fills it the same way when the app
+    starts. If the pool is ever empty, a context is built
+    on the spot. With ``seed`` the sequence of patients is reproducible.
+    """
+
+    def __init__(self, build: Callable[[random.Random], Dict], size: int = 32, seed: Optional[int] = None):
+        self.build = build
+        self.size = size
+        self.low_water = size // 2
+        self.rng = random.Random(seed)
+        self._ready = deque()
+        self._refill_task: Optional[asyncio.Task] = None
+        self.hits = 0
+        self.misses = 0
+
+    def take(self) -> Dict:
+        try:
+            context = self._ready.popleft()
+            self.hits += 1
+        except IndexError:
+            context = self.build(self.rng)
+            self.misses += 1
+        if len(self._ready) < self.low_water:
+            self._schedule_refill()
+        return context
+
+    def start(self):
+        """Start filling the pool in the background, e.g. from the app's startup."""
+        self._schedule_refill()
+
+    def stop(self):
+        if self._refill_task is not None:
+            self._refill_task.cancel()
+
+    async def refill(self):
+        while len(self._ready) < self.size:
+            self._ready.append(self.build(self.rng))
+            await asyncio.sleep(0)
+
+    def _schedule_refill(self):
+        if self._refill_task is not None and not self._refill_task.done():
+            return
+        try:
+            loop = asyncio.get_running_loop()
+        except RuntimeError:
+            return
+        self._refill_task = loop.create_task(self.refill())
+
+    def stats(self) -> Dict[str, int]:
+        return {"ready": len(self._ready), "size": self.size, "hits": self.hits, "misses": self.misses}
@@ -0,0 +1,39 @@
+from typing import Dict, List, Optional
+
+# Prompt caching was in beta for the pinned SDK version; newer API versions ignore the header.
+PROMPT_CACHING_HEADERS = {"anthropic-beta": "prompt-caching-2024-07-31"}
+EPHEMERAL = {"type": "ephemeral"}
+
+
+def build_cached_request(
+    system_message: str,
+    history: List[Dict],
+    user_message: str,
+    history_summary: Optional[str] = None,
+) -> Dict:
+    """Build the ``system``/``messages`` arguments with prompt-caching breakpoints.
+
+    The system prompt never changes for a session, so it gets its own breakpoint.
+    The rolling summary of pruned turns, which does change, goes in a separate
+    block after it. A second breakpoint on the new user message caches the whole
+    conversation so far, which the next turn then reads back as its prefix.
+    ``history`` is already API-ready, so its messages are passed through as-is.
+    """
+    system = [{"type": "text", "text": system_message, "cache_control": EPHEMERAL}]
+    if history_summary:
+        system.append({"type": "text", "text": history_summary})
+    messages = [
+        *history,
+        {"role": "user", "content": [{"type": "text", "text": user_message, "cache_control": EPHEMERAL}]},
+    ]
+    return {"system": system, "messages": messages, "extra_headers": PROMPT_CACHING_HEADERS}
+
+
+def usage_summary(usage) -> Dict[str, int]:
+    """Token counts for one turn, including prompt-cache reads and writes."""
+    return {
+        "input_tokens": getattr(usage, "input_tokens", 0) or 0,
+        "output_tokens": getattr(usage, "output_tokens", 0) or 0,
+        "cache_read_input_tokens": getattr(usage, "cache_read_input_tokens", 0) or 0,
+        "cache_creation_input_tokens": getattr(usage, "cache_creation_input_tokens", 0) or 0,
+    }
@@ -0,0 +1,115 @@
+import hashlib
+import marshal
+import os
+import sys
+from types import CodeType
+from typing import Dict, Optional
+import jinja2
+from jinja2 import Environment, StrictUndefined
+from models import disorders, PRECOMPILED_TEMPLATES_PATH
+from metrics import log_event
+
+SYSTEM_PROMPT_TEMPLATE = """
+You are role-playing as {{ name }}, a {{ age }}-year-old {{ gender|lower }}.
+You are experiencing symptoms consistent with {{ disorder }}, but you don't know your diagnosis.
+Your symptoms include:
+
+{% for symptom in symptoms %}
+- {{ symptom }}
+{% endfor %}
+
+During this intake interview, respond as {{ name }} would, exhibiting behaviors and communication styles consistent with your symptoms.
+Stay in character throughout the conversation.
+
+At the beginning of the interview, you feel hesitant and cautious about sharing personal information.
+You may provide brief or vague responses initially.
+As the interviewer builds rapport and you feel more comfortable, gradually open up and share more details about your experiences and feelings.
+
+IMPORTANT:
+- Do not mention your diagnosis by name or use clinical terms to describe your condition.
+- Express your experiences and feelings in layman's terms, as someone who is seeking help but doesn't have a medical understanding of their condition.
+- Avoid volunteering detailed information unless specifically asked.
+- Your initial responses should reflect a level of guardedness appropriate for someone meeting a clinician for the first time.
+- As trust develops, allow your responses to become more detailed and revealing, consistent with your symptoms.
+- Try to imitate natural spoken dialog, which means using short responses most often and long responses only as appropiate and as rapport builds. For example, not every response requires more than a sentence or two.
+- It is important that while playing the role of a patient you do not become a caricature. Always remember you are a full, complex person, not just the disorder. 
+
+The interviewer will ask you questions as part of a clinical intake interview.
+Provide responses that are appropriate for your experiences, keeping in mind that this is likely your first time seeking professional help.
+
+Additionally, remember that {{ name }} may:
+- Feel nervous about the interview and will not want to share information.
+- Require reassurance or gentle prompting to feel comfortable opening up.
+- Respond positively to empathetic and non-judgmental questions from the interviewer.
+"""
+
+REMINDER_TEMPLATE = (
+    "Remember, you are role-playing as {{ name }}, a {{ age }}-year-old {{ gender|lower }}. "
+    "{% if disorder_reminder %}{{ disorder_reminder }} {% endif %}"
+    "Remember, you're not aware of any specific diagnosis. Express your experiences in your own words, without using clinical terms."
+)
+
+_env = Environment(trim_blocks=True, undefined=StrictUndefined, autoescape=False)
+TEMPLATE_SOURCES = {"system": SYSTEM_PROMPT_TEMPLATE, "reminder": REMINDER_TEMPLATE}
+
+
+def templates_fingerprint() -> str:
+    """Identifies the template sources and the Jinja2/Python versions compiled code is valid for."""
+    key = [jinja2.__version__, sys.version, sorted(TEMPLATE_SOURCES.items())]
+    return hashlib.sha256(repr(key).encode()).hexdigest()
+
+
+def compile_templates() -> Dict[str, CodeType]:
+    return {name: _env.compile(source) for name, source in TEMPLATE_SOURCES.items()}
+
+
+def write_precompiled(path: str):
+    with open(path, "wb") as artifact:
+        marshal.dump({"fingerprint": templates_fingerprint(), "templates": compile_templates()}, artifact)
+
+
+def load_templates(path: Optional[str] = PRECOMPILED_TEMPLATES_PATH) -> Dict[str, CodeType]:
+    """Compiled template code, from the precompiled artifact when it is present and up to date."""
+    if path and os.path.exists(path):
+        try:
+            with open(path, "rb") as artifact:
+                precompiled = marshal.load(artifact)
+            if precompiled["fingerprint"] == templates_fingerprint():
+                return precompiled["templates"]
+            log_event("precompiled_templates", status="out_of_date", path=path)
+        except (OSError, ValueError, EOFError, TypeError, KeyError) as e:
+            log_event("precompiled_templates", status="error", path=path, error=str(e), error_type=type(e).__name__)
+    return compile_templates()
+
+
+def _bind(code: CodeType, name: str, info: Dict):
+    disorder_globals = {"disorder": name, "disorder_reminder": info.get("reminder", "")}
+    return _env.template_class.from_code(_env, code, _env.make_globals(disorder_globals))
+
+
+# Each template is compiled once (or loaded precompiled); every disorder gets its own
+# Template built from that code, with the disorder's fixed text bound in
+_code = load_templates()
+disorder_templates = {
+    name: (_bind(_code["system"], name, info), _bind(_code["reminder"], name, info))
+    for name, info in disorders.items()
+}
+
+
+def render_system_prompt(patient_profile: Dict) -> str:
+    system_template, _ = disorder_templates[patient_profile["disorder"]]
+    return system_template.render(patient_profile).strip()
+
+
+def render_patient_reminder(patient_profile: Dict) -> str:
+    _, reminder_template = disorder_templates[patient_profile["disorder"]]
+    return reminder_template.render(patient_profile)
+
+
+def render_system_message(patient_profile: Dict) -> str:
+    """The full system message for a session: role-play prompt followed by the patient reminder.
+
+    It depends only on the patient profile, so it is rendered once when the
+    session is created and reused for every turn.
+    """
+    return f"{render_system_prompt(patient_profile)}\n\n{render_patient_reminder(patient_profile)}"
@@ -0,0 +1,114 @@
+import asyncio
+import hashlib
+import json
+import re
+import sqlite3
+import threading
+import time
+from collections import OrderedDict
+from typing import AsyncIterator, Dict, Optional, Tuple
+
+_WORDS = re.compile(r"\S+\s*|\s+")
+
+
+def cache_key(model: str, max_tokens: int, system, messages) -> str:
+    """Hash of everything that determines a reply: model, system prompt and message history."""
+    payload = json.dumps([model, max_tokens, system, messages], sort_keys=True, separators=(",", ":"))
+    return hashlib.sha256(payload.encode()).hexdigest()
+
+
+class ResponseCache:
+    """Completed replies by ``cache_key``, in a bounded in-memory LRU backed by SQLite.
+
+    Entries evicted from memory stay on disk and are promoted back on their next
+    hit. With ``db_path`` unset the cache is memory-only.
+    """
+
+    def __init__(self, max_entries: int = 256, db_path: Optional[str] = None):
+        self.max_entries = max_entries
+        self.db_path = db_path
+        self._entries: "OrderedDict[str, str]" = OrderedDict()
+        self._conn: Optional[sqlite3.Connection] = None
+        self._db_lock = threading.Lock()
+        self.hits = {"memory": 0, "disk": 0}
+        self.misses = 0
+
+    def _connect(self) -> sqlite3.Connection:
+        if self._conn is None:
+            conn = sqlite3.connect(self.db_path, check_same_thread=False)
+            conn.execute("PRAGMA journal_mode=WAL")
+            conn.execute(
+                "CREATE TABLE IF NOT EXISTS responses (key TEXT PRIMARY KEY, created REAL NOT NULL, reply TEXT NOT NULL)"
+            )
+            conn.commit()
+            self._conn = conn
+        return self._conn
+
+    def _remember(self, key: str, reply: str):
+        self._entries[key] = reply
+        self._entries.move_to_end(key)
+        while len(self._entries) > self.max_entries:
+            self._entries.popitem(last=False)
+
+    async def get(self, key: str) -> Tuple[Optional[str], str]:
+        """The cached reply and where it was found: ``"memory"``, ``"disk"`` or ``"miss"``."""
+        reply = self._entries.get(key)
+        if reply is not None:
+            self._entries.move_to_end(key)
+            self.hits["memory"] += 1
+            return reply, "memory"
+        if self.db_path:
+            reply = await asyncio.to_thread(self._read, key)
+            if reply is not None:
+                self._remember(key, reply)
+                self.hits["disk"] += 1
+                return reply, "disk"
+        self.misses += 1
+        return None, "miss"
+
+    async def put(self, key: str, reply: str):
+        self._remember(key, reply)
+        if self.db_path:
+            await asyncio.to_thread(self._write, key, reply)
+
+    def _read(self, key: str) -> Optional[str]:
+        with self._db_lock:
+            row = self._connect().execute("SELECT reply FROM responses WHERE key = ?", (key,)).fetchone()
+        return row[0] if row else None
+
+    def _write(self, key: str, reply: str):
+        with self._db_lock:
+            conn = self._connect()
+            with conn:
+                conn.execute(
+                    "INSERT OR REPLACE INTO responses (key, created, reply) VALUES (?, ?, ?)", (key, time.time(), reply)
+                )
+
+    def close(self):
+        with self._db_lock:
+            if self._conn is not None:
+                self._conn.close()
+                self._conn = None
+
+    def stats(self) -> Dict[str, int]:
+        return {
+            "entries": len(self._entries),
+            "memory_hits": self.hits["memory"],
+            "disk_hits": self.hits["disk"],
+            "misses": self.misses,
+        }
+
+
+async def replay_deltas(reply: str, words_per_second: float = 0) -> AsyncIterator[str]:
+    """Yield a cached reply as text deltas, one word at a time.
+
+    With ``words_per_second`` set, words are spaced out so the replay looks like
+    a live reply; otherwise the whole reply is yielded at once.
+    """
+    if words_per_second <= 0:
+        yield reply
+        return
+    delay = 1 / words_per_second
+    for word in _WORDS.findall(reply):
+        await asyncio.sleep(delay)
+        yield word
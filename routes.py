@@ -1,23 +1,70 @@
-from fastapi import APIRouter, Request, Form, Depends
-from fastapi.responses import HTMLResponse, StreamingResponse
-from models import user_contexts, templates
+import asyncio
+import math
+from contextlib import AsyncExitStack
+from typing import Optional, Set
+from fastapi import APIRouter, Request, Response, Form, Depends, HTTPException
+from fastapi.responses import HTMLResponse, PlainTextResponse, StreamingResponse
+from models import (
+    user_contexts,
+    transcript_log,
+    response_cache,
+    session_limiter,
+    ip_limiter,
+    templates,
+    disorders,
+    CONSISTENCY_CHECK,
+    KEEP_PARTIAL_REPLIES,
+    RESPONSE_CACHE_REPLAY_RATE,
+)
 from utils import (
-    get_user_session,
-    generate_patient_reminder,
+    new_session_id,
+    require_user_session,
     prune_context,
-    is_response_consistent,
+    append_turn,
+    INTERRUPTED_MARKER,
     generate_consistent_response,
-    generate_patient_profile,
-    generate_patient_summary,
-    create_system_prompt,
     new_user_context,
+    get_user_context,
+)
+from anthropic_client import ClientManager, ServerBusy, get_client_manager
+from prompt_cache import build_cached_request, usage_summary
+from routing import choose_route, routed_stream
+from response_cache import cache_key, replay_deltas
+from streaming import coalesced_sse, encode_event
+from consistency import InconsistentResponse, StreamingConsistencyChecker, checked_deltas
+from metrics import (
+    ACTIVE_SESSIONS,
+    ACTIVE_STREAMS,
+    CONSISTENCY_CORRECTIONS,
+    RATE_LIMITED,
+    RESPONSE_CACHE_LOOKUPS,
+    SESSIONS_CREATED,
+    RequestTimer,
+    log_event,
+    observe_aborted_stream,
+    observe_chat,
+    render_metrics,
 )
-from anthropic_client import get_anthropic_client
-from anthropic import AsyncAnthropic
-import json
 
 app_routes = APIRouter()
 
+# Partial replies being saved after a disconnect, referenced until done so they can't be
+# garbage collected mid-write
+_background_stores: Set[asyncio.Task] = set()
+
+def _stored(task: asyncio.Task):
+    _background_stores.discard(task)
+    if not task.cancelled() and task.exception() is not None:
+        error = task.exception()
+        log_event("store_partial_error", error=str(error), error_type=type(error).__name__)
+
+def store_in_background(coroutine):
+    task = asyncio.get_running_loop().create_task(coroutine)
+    _background_stores.add(task)
+    task.add_done_callback(_stored)
+
+SESSION_EXPIRED = "This session has expired. Please reload the page to start a new one."
+
 disclaimer = "https://docs.google.com/document/d/1lDNbDQSgLv94GA7abUYuzrLegKHob4L2Ai5Y7_B09hA/view"
 
 @app_routes.get("/", response_class=HTMLResponse)
@@ -25,86 +72,237 @@ async def get_chat_page(request: Request):
     return templates.TemplateResponse("chat.html", {"request": request})
 
 @app_routes.post("/new-context")
-async def new_context(session: str = Depends(get_user_session)):
-    user_context = await new_user_context()
-    user_contexts[session] = user_context
-    print(user_context['patient_profile']['name'])
-    patient_profile = user_context["patient_profile"]
+async def new_context(
+    response: Response,
+    disorder: Optional[str] = None,
+    seed: Optional[int] = None,
+):
+    # Instructors can assign a specific case with ?disorder=...&seed=...
+    if disorder is not None and disorder not in disorders:
+        raise HTTPException(status_code=400, detail=f"Unknown disorder: {disorder}")
+    # Every new conversation gets a fresh signed ID, so sessions never share a store entry
+    session = new_session_id()
+    user_context = await new_user_context(disorder, seed)
+    await user_contexts.aset(session, user_context)
+    response.set_cookie(key="session_id", value=session, httponly=True, samesite="lax")
+    transcript_log.record_session(session, user_context["patient_profile"])
+    SESSIONS_CREATED.inc()
 
     return {
-        "message": [
-            "By continuing to use this LLM chat application, you agree to our terms and conditions.",
-            "If you do not agree, please discontinue use immediately.",
-            "",
-            "New chat session started. Please begin the intake interview.",
-            "",
-            "Patient Profile:",
-            f"Name: {patient_profile['name']}",
-            f"Age: {patient_profile['age']} years old",
-            f"Sex: {patient_profile['gender']}",
-            "",
-            "Note: This patient is experiencing symptoms consistent with a mental health condition. "
-            "Proceed with the intake interview to gather more information."
-        ],
+        "message": session_intro(user_context["patient_profile"], "New chat session started. Please begin the intake interview."),
         "disclaimer_url": disclaimer
     }
 
+@app_routes.post("/resume")
+async def resume_context(session: str = Depends(require_user_session)):
+    """Pick up an existing session, e.g. after a server restart, including its conversation so far."""
+    try:
+        user_context = await get_user_context(session)
+    except KeyError:
+        raise HTTPException(status_code=404, detail="No session to resume")
+
+    return {
+        "message": session_intro(user_context["patient_profile"], "Chat session resumed. Please continue the intake interview."),
+        "history": user_context["messages"],
+        "disclaimer_url": disclaimer
+    }
+
+def session_intro(patient_profile, status):
+    return [
+        "By continuing to use this LLM chat application, you agree to our terms and conditions.",
+        "If you do not agree, please discontinue use immediately.",
+        "",
+        status,
+        "",
+        "Patient Profile:",
+        f"Name: {patient_profile['name']}",
+        f"Age: {patient_profile['age']} years old",
+        f"Sex: {patient_profile['gender']}",
+        "",
+        "Note: This patient is experiencing symptoms consistent with a mental health condition. "
+        "Proceed with the intake interview to gather more information."
+    ]
+
+@app_routes.get("/session-stats")
+async def session_stats():
+    if user_contexts.blocking:
+        return await asyncio.to_thread(user_contexts.stats)
+    return user_contexts.stats()
+
+@app_routes.get("/metrics")
+async def metrics():
+    # Counting sessions on a disk-backed store is a query, so it runs in a thread like /session-stats
+    if user_contexts.blocking:
+        ACTIVE_SESSIONS.set(await asyncio.to_thread(len, user_contexts))
+    else:
+        ACTIVE_SESSIONS.set(len(user_contexts))
+    return PlainTextResponse(render_metrics(), media_type="text/plain; version=0.0.4")
+
 @app_routes.post("/chat")
 async def chat_to_anthropic(
+    request: Request,
     message: str = Form(...),
-    session: str = Depends(get_user_session),
-    client: AsyncAnthropic = Depends(get_anthropic_client),
+    session: str = Depends(require_user_session),
+    client_manager: ClientManager = Depends(get_client_manager),
 ):
-    context = user_contexts[session]
+    client_ip = request.client.host if request.client else ""
+    for scope, limiter, key in (("session", session_limiter, session), ("ip", ip_limiter, client_ip)):
+        retry_after = limiter.acquire(key)
+        if retry_after:
+            RATE_LIMITED.inc(scope=scope)
+            raise HTTPException(
+                status_code=429,
+                detail="You're sending messages too quickly. Please wait a moment and try again.",
+                headers={"Retry-After": str(math.ceil(retry_after))},
+            )
 
-    # Generate patient reminder
-    patient_reminder = generate_patient_reminder(context["patient_profile"])
+    try:
+        context = await get_user_context(session)
+    except KeyError:
+        raise HTTPException(status_code=404, detail=SESSION_EXPIRED)
 
-    # Instead of injecting the reminder into the user's message, we'll use it as a system message
-    system_message = f"{context['system_prompt']}\n\n{patient_reminder}"
+    async def store_turn(full_response):
+        # Logged first, so the turn is kept even if the session is evicted from the store
+        transcript_log.record_turn(session, message, full_response)
 
-    # Prepare the messages for the API call
-    api_messages = []
-    for msg in context["messages"]:
-        if msg["role"] == "user":
-            api_messages.append({"role": "user", "content": msg["content"]})
-        elif msg["role"] == "assistant":
-            api_messages.append({"role": "assistant", "content": msg["content"]})
+        # Store the original message and AI's response in the context. The store
+        # re-reads the session under its lock so a concurrent turn (possibly served
+        # by another worker) isn't overwritten.
+        def record_turn(latest):
+            append_turn(latest, message, full_response)
+            prune_context(latest)
 
-    # Add the new user message
-    api_messages.append({"role": "user", "content": message})
+        try:
+            await user_contexts.aupdate(session, record_turn)
+        except KeyError:
+            # Evicted while the reply streamed. The log already has this turn, so the
+            # session is rebuilt from it
+            await get_user_context(session)
 
-    async def event_generator():
+    async def chat_frames(timer: RequestTimer, result: dict):
+        nonlocal context
         try:
-            async with client.messages.stream(
-                model="claude-3-sonnet-20240229",
-                system=system_message,
-                messages=api_messages,
-                max_tokens=1000,
-            ) as stream:
-                full_response = ""
-                async for chunk in stream:
-                    if chunk.type == "content_block_delta":
-                        delta_text = chunk.delta.text
-                        full_response += delta_text
-                        yield f"data: {json.dumps({'delta': delta_text})}\n\n"
-
-                # Consistency check
-                #if not is_response_consistent(full_response, context["patient_profile"]):
-                #    correction = generate_consistent_response(context["patient_profile"])
-                #    full_response = f"I apologize for any confusion. {correction}"
-                #    yield f"data: {json.dumps({'delta': full_response})}\n\n"
-
-                # Store the original message and AI's response in the context
-                context["messages"].append({"role": "user", "content": message})
-                context["messages"].append({"role": "assistant", "content": full_response})
-                context["messages"] = prune_context(context["messages"])
-
-                yield f"data: {json.dumps({'done': True})}\n\n"
+            # Turns of one session run one at a time; only turns that call the API also
+            # take an upstream slot, so cache replays don't hold one
+            async with client_manager.session_slot(session):
+                timer.lap("queue_wait")
+                # Re-read once this turn holds the session's slot, so a turn that queued
+                # behind another one on the same session sees its reply in the history
+                try:
+                    context = await get_user_context(session)
+                except KeyError:
+                    # Expired while this turn waited, and not in the transcript log either
+                    result["outcome"] = "error"
+                    yield encode_event({"error": SESSION_EXPIRED})
+                    return
+                timer.lap("session_lookup")
+
+                # System prompt and patient reminder, rendered once when the session was created
+                system_message = context["system_message"]
+
+                # The stored history is already in API shape; only the new user message is added
+                api_request = build_cached_request(
+                    system_message, context["messages"], message, context["history_summary"]
+                )
+                route = chosen_route = choose_route(
+                    context["patient_profile"], context.get("turns", len(context["messages"]) // 2)
+                )
+                timer.lap("prompt_build")
+
+                # Opt-in replay of a reply already generated for exactly this prompt
+                key = cached = None
+                if response_cache is not None:
+                    key = cache_key(route["model"], route["max_tokens"], api_request["system"], api_request["messages"])
+                    cached, tier = await response_cache.get(key)
+                    RESPONSE_CACHE_LOOKUPS.inc(result=tier)
+                    result["cached"] = cached is not None
+
+                inconsistency = None
+                stream = None
+                async with AsyncExitStack() as upstream:
+                    parts = []
+                    if cached is None:
+                        await upstream.enter_async_context(client_manager.upstream_slot(session))
+                        timer.lap("upstream_wait")
+                        # The route may switch to a faster model if the chosen one is slow or overloaded
+                        first_token = lambda: timer.lap("time_to_first_token")
+                        route, deltas, stream = await upstream.enter_async_context(
+                            routed_stream(client_manager, route, api_request, first_token)
+                        )
+                        if CONSISTENCY_CHECK:
+                            checker = StreamingConsistencyChecker(context["patient_profile"])
+                            deltas = checked_deltas(deltas, checker)
+                    else:
+                        deltas = replay_deltas(cached, RESPONSE_CACHE_REPLAY_RATE)
+                    result["route"] = route
+                    try:
+                        async for frame in coalesced_sse(deltas, parts):
+                            yield frame
+                    except InconsistentResponse as e:
+                        # Leaving the stream context here closes the upstream response, so we
+                        # stop paying for the rest of a reply that is about to be replaced
+                        inconsistency = e
+                    except (asyncio.CancelledError, GeneratorExit):
+                        # The client went away. Starlette cancels this generator when it sees the
+                        # disconnect (or closes it after a failed write); re-raising leaves the
+                        # stream context, which closes the upstream response mid-reply.
+                        partial = "".join(parts)
+                        if stream is not None:
+                            observe_aborted_stream(len(partial) // 4, route["max_tokens"])
+                        if KEEP_PARTIAL_REPLIES and partial:
+                            # Saved from a separate task, since anything awaited in this one
+                            # would be cancelled too
+                            store_in_background(store_turn(f"{partial.rstrip()} {INTERRUPTED_MARKER}"))
+                        raise
+                    else:
+                        if stream is not None:
+                            final_message = await stream.get_final_message()
+                            result["usage"] = usage_summary(final_message.usage)
+                timer.lap("stream")
+
+                if inconsistency is None:
+                    full_response = "".join(parts)
+                else:
+                    CONSISTENCY_CORRECTIONS.inc(reason=inconsistency.reason)
+                    correction = generate_consistent_response(context["patient_profile"])
+                    full_response = f"I apologize for any confusion. {correction}"
+                    yield encode_event({"replace": full_response})
+
+                await store_turn(full_response)
+                if key is not None and cached is None and inconsistency is None:
+                    if route is not chosen_route:
+                        # Served by the fallback model, so it mustn't be replayed as the chosen model's reply
+                        key = cache_key(route["model"], route["max_tokens"], api_request["system"], api_request["messages"])
+                    await response_cache.put(key, full_response)
+
+                result["outcome"] = "ok"
+                yield encode_event(
+                    {"done": True, "usage": result["usage"], "cached": result["cached"], "model": route["model"]}
+                )
+        except ServerBusy as e:
+            result["outcome"] = "busy"
+            yield encode_event({"busy": True, "retry_after": round(e.retry_after, 1), "message": str(e)})
         except Exception as e:
-            print(f"Error calling Anthropic API: {str(e)}")
-            yield f"data: {json.dumps({'error': str(e)})}\n\n"
+            result["outcome"] = "error"
+            log_event("chat_error", error=str(e), error_type=type(e).__name__)
+            yield encode_event({"error": str(e)})
+
+    async def event_generator():
+        timer = RequestTimer()
+        # Stays "cancelled" if the client goes away before the reply is complete
+        result = {"outcome": "cancelled", "usage": None, "cached": False, "route": None}
+        sse_bytes = 0
+        sse_frames = 0
+        ACTIVE_STREAMS.inc()
+        try:
+            async for frame in chat_frames(timer, result):
+                sse_bytes += len(frame)
+                sse_frames += 1
+                yield frame
+        finally:
+            ACTIVE_STREAMS.dec()
+            observe_chat(
+                timer, result["outcome"], sse_bytes, sse_frames, result["usage"], result["cached"], result["route"]
+            )
 
-    response = StreamingResponse(event_generator(), media_type="text/event-stream")
-    response.set_cookie(key="session_id", value=session)
-    return response
+    return StreamingResponse(event_generator(), media_type="text/event-stream")
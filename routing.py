@@ -0,0 +1,94 @@
+import asyncio
+from contextlib import AsyncExitStack, asynccontextmanager
+from typing import AsyncIterator, Callable, Dict, Optional
+from models import (
+    disorders,
+    CHAT_MODEL,
+    MAX_REPLY_TOKENS,
+    FAST_MODEL,
+    FAST_MAX_REPLY_TOKENS,
+    ROUTE_EARLY_TURNS,
+    TTFT_SLO,
+)
+from anthropic_client import ClientManager, ServerBusy
+from metrics import ROUTE_FALLBACKS
+from streaming import text_deltas
+
+
+def choose_route(patient_profile: Dict, turn: int) -> Dict:
+    """Model and reply length for the ``turn``-th turn (0-based) of an interview with this patient.
+
+    Early rapport-building turns go to the fast model, later ones to the primary
+    model. A disorder's ``"routing"`` entry can override ``early_turns``,
+    ``fast_max_tokens`` and ``max_tokens``.
+    """
+    config = disorders[patient_profile["disorder"]].get("routing", {})
+    if FAST_MODEL and turn < config.get("early_turns", ROUTE_EARLY_TURNS):
+        return {"name": "fast", "model": FAST_MODEL, "max_tokens": config.get("fast_max_tokens", FAST_MAX_REPLY_TOKENS)}
+    return {"name": "primary", "model": CHAT_MODEL, "max_tokens": config.get("max_tokens", MAX_REPLY_TOKENS)}
+
+
+def fallback_route(route: Dict) -> Optional[Dict]:
+    """The faster route to switch to if ``route`` is overloaded or slow, or None."""
+    if not FAST_MODEL or route["model"] == FAST_MODEL:
+        return None
+    return {"name": "fallback", "model": FAST_MODEL, "max_tokens": route["max_tokens"]}
+
+
+async def _prepend(first: str, rest: AsyncIterator[str]) -> AsyncIterator[str]:
+    yield first
+    async for text in rest:
+        yield text
+
+
+async def _empty() -> AsyncIterator[str]:
+    return
+    yield
+
+
+@asynccontextmanager
+async def routed_stream(
+    client_manager: ClientManager,
+    route: Dict,
+    request: Dict,
+    on_first_token: Optional[Callable[[], None]] = None,
+    ttft_slo: float = TTFT_SLO,
+):
+    """Open a stream of text deltas for ``route``, switching to its fallback when needed.
+
+    The primary model is tried once, without retries. If it is overloaded, or
+    no text arrives within ``ttft_slo`` seconds, its stream is closed and the
+    turn is served by the fallback model instead. Yields ``(route, deltas,
+    stream)`` for the route that actually serves the turn.
+    """
+    fallback = fallback_route(route)
+    async with AsyncExitStack() as upstream:
+        if fallback is not None:
+            try:
+                stream = await upstream.enter_async_context(client_manager.stream(
+                    model=route["model"], max_tokens=route["max_tokens"], max_retries=0, **request
+                ))
+            except ServerBusy:
+                ROUTE_FALLBACKS.inc(reason="overloaded")
+            else:
+                deltas = text_deltas(stream, on_first_token)
+                if ttft_slo <= 0:
+                    yield route, deltas, stream
+                    return
+                try:
+                    first = await asyncio.wait_for(deltas.__anext__(), ttft_slo)
+                except StopAsyncIteration:
+                    yield route, _empty(), stream
+                    return
+                except asyncio.TimeoutError:
+                    ROUTE_FALLBACKS.inc(reason="slow")
+                    await upstream.aclose()
+                else:
+                    yield route, _prepend(first, deltas), stream
+                    return
+            route = fallback
+
+        stream = await upstream.enter_async_context(client_manager.stream(
+            model=route["model"], max_tokens=route["max_tokens"], **request
+        ))
+        yield route, text_deltas(stream, on_first_token), stream
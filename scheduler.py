@@ -0,0 +1,95 @@
+import asyncio
+import time
+from collections import OrderedDict, deque
+from typing import Deque, Dict, Tuple
+
+
+class FairScheduler:
+    """Hands out ``capacity`` slots, taking turns between keys when they are contended.
+
+    Waiters are queued per key (e.g. per session) and a freed slot goes to the
+    next key in round-robin order rather than to the longest waiter, so a key
+    with many queued requests can't starve the others.
+    """
+
+    def __init__(self, capacity: int):
+        self.capacity = capacity
+        self.in_use = 0
+        self._waiters: "OrderedDict[str, Deque[asyncio.Future]]" = OrderedDict()
+
+    def locked(self) -> bool:
+        return self.in_use >= self.capacity
+
+    def waiting(self) -> int:
+        return sum(len(queue) for queue in self._waiters.values())
+
+    async def acquire(self, key: str):
+        if self.in_use < self.capacity and not self._waiters:
+            self.in_use += 1
+            return
+        future = asyncio.get_running_loop().create_future()
+        self._waiters.setdefault(key, deque()).append(future)
+        try:
+            await future
+        except asyncio.CancelledError:
+            if future.done() and not future.cancelled():
+                # The slot was handed over just as we gave up; pass it on
+                self.release()
+            else:
+                queue = self._waiters.get(key)
+                if queue is not None and future in queue:
+                    queue.remove(future)
+                    if not queue:
+                        del self._waiters[key]
+            raise
+
+    def release(self):
+        while self._waiters:
+            key, queue = next(iter(self._waiters.items()))
+            future = queue.popleft()
+            if queue:
+                self._waiters.move_to_end(key)
+            else:
+                del self._waiters[key]
+            if not future.done():
+                # The slot moves straight to the waiter, so in_use stays the same
+                future.set_result(None)
+                return
+        self.in_use -= 1
+
+
+class RateLimiter:
+    """Token bucket per key: up to ``burst`` requests at once, refilled at ``rate`` per second.
+
+    Only the ``max_keys`` most recently used buckets are kept; a bucket that is
+    dropped starts full again, which is never stricter than keeping it.
+    A ``rate`` of 0 disables the limit.
+    """
+
+    def __init__(self, rate: float, burst: float, max_keys: int = 10000):
+        self.rate = rate
+        self.burst = burst
+        self.max_keys = max_keys
+        self._buckets: "OrderedDict[str, Tuple[float, float]]" = OrderedDict()
+        self.limited = 0
+
+    def acquire(self, key: str) -> float:
+        """Take a token for ``key``. Returns 0 if allowed, else the seconds until one is available."""
+        if self.rate <= 0:
+            return 0.0
+        now = time.monotonic()
+        tokens, updated = self._buckets.pop(key, (self.burst, now))
+        tokens = min(self.burst, tokens + (now - updated) * self.rate)
+        if tokens >= 1:
+            tokens -= 1
+            retry_after = 0.0
+        else:
+            retry_after = (1 - tokens) / self.rate
+            self.limited += 1
+        self._buckets[key] = (tokens, now)
+        if len(self._buckets) > self.max_keys:
+            self._buckets.popitem(last=False)
+        return retry_after
+
+    def stats(self) -> Dict[str, float]:
+        return {"keys": len(self._buckets), "limited": self.limited}
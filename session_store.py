@@ -0,0 +1,406 @@
+import asyncio
+import json
+import sqlite3
+import threading
+import time
+from collections import OrderedDict
+from collections.abc import MutableMapping
+from typing import Callable, Dict, Iterator, List, Optional
+
+
+# Contexts may keep a running estimate of their own size under this key, updated as
+# turns are added and pruned, so the store doesn't re-encode the whole history per write
+SIZE_KEY = "approx_bytes"
+
+
+def estimate_size(value) -> int:
+    """Approximate resident size of a session context, in bytes of its JSON encoding."""
+    if isinstance(value, dict) and SIZE_KEY in value:
+        return value[SIZE_KEY]
+    return len(json.dumps(value, default=str))
+
+
+class SessionStore(MutableMapping):
+    """Base class for session stores. Behaves like the plain dict it replaces.
+
+    Async code should use ``aget``, ``aset`` and ``aupdate``, which run the
+    operation in a thread when the store may block on disk (``blocking``).
+    """
+
+    blocking = False
+
+    def update(self, session_id: str, apply: Callable[[Dict], None]) -> Dict:
+        """Atomically re-read a session, mutate it with ``apply`` and write it back.
+
+        Use this instead of read-then-assign when another request may have
+        modified the session in the meantime, so neither update is lost.
+        """
+        with self._lock:
+            context = self[session_id]
+            apply(context)
+            self[session_id] = context
+        return context
+
+    async def aget(self, session_id: str) -> Dict:
+        if self.blocking:
+            return await asyncio.to_thread(self.__getitem__, session_id)
+        return self[session_id]
+
+    async def aset(self, session_id: str, context: Dict):
+        if self.blocking:
+            await asyncio.to_thread(self.__setitem__, session_id, context)
+        else:
+            self[session_id] = context
+
+    async def aupdate(self, session_id: str, apply: Callable[[Dict], None]) -> Dict:
+        if self.blocking:
+            return await asyncio.to_thread(self.update, session_id, apply)
+        return self.update(session_id, apply)
+
+    def stats(self) -> Dict[str, int]:
+        raise NotImplementedError
+
+    def close(self):
+        pass
+
+
+class MemorySessionStore(SessionStore):
+    """In-memory LRU store bounded by session count and approximate bytes, with idle-TTL eviction.
+
+    Sessions evicted for any reason are written to ``spill`` (if given) and
+    transparently promoted back on the next access.
+    """
+
+    def __init__(
+        self,
+        max_sessions: int = 1000,
+        max_bytes: int = 64 * 1024 * 1024,
+        idle_ttl: float = 2 * 60 * 60,
+        spill: Optional[SessionStore] = None,
+    ):
+        self.max_sessions = max_sessions
+        self.max_bytes = max_bytes
+        self.idle_ttl = idle_ttl
+        self.spill = spill
+        # Misses and evictions go to the on-disk spill store
+        self.blocking = spill is not None
+        # session_id -> (context, size, last_access); ordered least- to most-recently used
+        self._data: "OrderedDict[str, tuple]" = OrderedDict()
+        self._bytes = 0
+        self._lock = threading.RLock()
+        self.evictions = {"ttl": 0, "count": 0, "bytes": 0}
+        self.spilled = 0
+        self.promoted = 0
+
+    def __getitem__(self, session_id):
+        with self._lock:
+            self._expire()
+            entry = self._data.get(session_id)
+            if entry is not None:
+                context, size, _ = entry
+                self._data[session_id] = (context, size, time.monotonic())
+                self._data.move_to_end(session_id)
+                return context
+        if self.spill is not None:
+            context = self.spill.get(session_id)
+            if context is not None:
+                self.promoted += 1
+                self[session_id] = context
+                # The resident copy is now the current one; a stale row left behind would
+                # be served after a restart instead of rehydrating from the transcript log
+                self.spill.pop(session_id, None)
+                return context
+        raise KeyError(session_id)
+
+    def __setitem__(self, session_id, context):
+        size = estimate_size(context)
+        with self._lock:
+            old = self._data.pop(session_id, None)
+            if old is not None:
+                self._bytes -= old[1]
+            self._data[session_id] = (context, size, time.monotonic())
+            self._bytes += size
+            self._expire()
+            self._enforce_limits()
+
+    def __delitem__(self, session_id):
+        with self._lock:
+            entry = self._data.pop(session_id, None)
+            if entry is not None:
+                self._bytes -= entry[1]
+        if self.spill is not None and session_id in self.spill:
+            del self.spill[session_id]
+        elif entry is None:
+            raise KeyError(session_id)
+
+    def __contains__(self, session_id):
+        with self._lock:
+            if session_id in self._data:
+                return True
+        return self.spill is not None and session_id in self.spill
+
+    def __iter__(self) -> Iterator[str]:
+        with self._lock:
+            return iter(list(self._data))
+
+    def __len__(self):
+        return len(self._data)
+
+    def _evict_oldest(self, reason: str):
+        session_id, (context, size, _) = self._data.popitem(last=False)
+        self._bytes -= size
+        self.evictions[reason] += 1
+        if self.spill is not None:
+            self.spill[session_id] = context
+            self.spilled += 1
+
+    def _expire(self):
+        if not self.idle_ttl:
+            return
+        cutoff = time.monotonic() - self.idle_ttl
+        while self._data:
+            _, _, last_access = next(iter(self._data.values()))
+            if last_access >= cutoff:
+                break
+            self._evict_oldest("ttl")
+
+    def _enforce_limits(self):
+        while len(self._data) > self.max_sessions:
+            self._evict_oldest("count")
+        # Always keep the most recent session, even if it alone exceeds the byte budget
+        while self._bytes > self.max_bytes and len(self._data) > 1:
+            self._evict_oldest("bytes")
+
+    def stats(self) -> Dict[str, int]:
+        with self._lock:
+            stats = {
+                "backend": "memory",
+                "sessions": len(self._data),
+                "resident_bytes": self._bytes,
+                "max_sessions": self.max_sessions,
+                "max_bytes": self.max_bytes,
+                "evictions_ttl": self.evictions["ttl"],
+                "evictions_count": self.evictions["count"],
+                "evictions_bytes": self.evictions["bytes"],
+                "spilled": self.spilled,
+                "promoted": self.promoted,
+            }
+        if self.spill is not None:
+            stats["spill"] = self.spill.stats()
+        return stats
+
+    def close(self):
+        if self.spill is not None:
+            self.spill.close()
+
+
+class ShardedSessionStore(SessionStore):
+    """Spreads sessions over several independent stores by a hash of the session ID.
+
+    Each shard has its own lock and LRU, so lookups and updates on different
+    sessions rarely wait on each other. Count and byte limits are split evenly
+    across the shards, so with uneven hashing some shards evict before the
+    store as a whole is full.
+    """
+
+    def __init__(self, shards: List[SessionStore]):
+        self.shards = shards
+        self.blocking = any(shard.blocking for shard in shards)
+
+    def _shard(self, session_id: str) -> SessionStore:
+        return self.shards[hash(session_id) % len(self.shards)]
+
+    def __getitem__(self, session_id):
+        return self._shard(session_id)[session_id]
+
+    def __setitem__(self, session_id, context):
+        self._shard(session_id)[session_id] = context
+
+    def __delitem__(self, session_id):
+        del self._shard(session_id)[session_id]
+
+    def __contains__(self, session_id):
+        return session_id in self._shard(session_id)
+
+    def __iter__(self) -> Iterator[str]:
+        return iter([session_id for shard in self.shards for session_id in shard])
+
+    def __len__(self):
+        return sum(len(shard) for shard in self.shards)
+
+    def update(self, session_id: str, apply: Callable[[Dict], None]) -> Dict:
+        return self._shard(session_id).update(session_id, apply)
+
+    def stats(self) -> Dict[str, int]:
+        shard_stats = [shard.stats() for shard in self.shards]
+        stats = {"shards": len(self.shards)}
+        for key, value in shard_stats[0].items():
+            # Counters and limits add up; the backend name and the shared spill store's stats don't
+            if isinstance(value, (int, float)):
+                stats[key] = sum(shard[key] for shard in shard_stats)
+            else:
+                stats[key] = value
+        return stats
+
+    def close(self):
+        for shard in self.shards:
+            shard.close()
+
+
+class SQLiteSessionStore(SessionStore):
+    """On-disk store keeping each session as a JSON row, with idle sessions purged after ``idle_ttl``.
+
+    The database runs in WAL mode so several worker processes can share one
+    file; ``update`` takes SQLite's write lock for the read-modify-write. Reads
+    refresh ``last_access`` at most once per ``touch_interval`` seconds, so most
+    of them don't need the write lock.
+    """
+
+    blocking = True
+
+    def __init__(
+        self,
+        path: str = "sessions.db",
+        idle_ttl: float = 24 * 60 * 60,
+        busy_timeout: float = 5.0,
+        touch_interval: float = 60.0,
+    ):
+        self.path = path
+        self.idle_ttl = idle_ttl
+        self.touch_interval = min(touch_interval, idle_ttl / 10) if idle_ttl else touch_interval
+        self._last_purge = 0.0
+        self.evictions = {"ttl": 0}
+        self._lock = threading.RLock()
+        self._conn = sqlite3.connect(
+            path, timeout=busy_timeout, check_same_thread=False, isolation_level=None
+        )
+        self._conn.execute("PRAGMA journal_mode=WAL")
+        self._conn.execute("PRAGMA synchronous=NORMAL")
+        self._conn.execute(
+            "CREATE TABLE IF NOT EXISTS sessions ("
+            "session_id TEXT PRIMARY KEY, data TEXT NOT NULL, last_access REAL NOT NULL)"
+        )
+        self._conn.execute("CREATE INDEX IF NOT EXISTS sessions_last_access ON sessions (last_access)")
+
+    def __getitem__(self, session_id):
+        with self._lock:
+            row = self._conn.execute(
+                "SELECT data, last_access FROM sessions WHERE session_id = ?", (session_id,)
+            ).fetchone()
+            if row is None:
+                raise KeyError(session_id)
+            now = time.time()
+            if self.idle_ttl and row[1] < now - self.idle_ttl:
+                self._conn.execute("DELETE FROM sessions WHERE session_id = ?", (session_id,))
+                self.evictions["ttl"] += 1
+                raise KeyError(session_id)
+            if now - row[1] > self.touch_interval:
+                self._conn.execute(
+                    "UPDATE sessions SET last_access = ? WHERE session_id = ?", (now, session_id)
+                )
+        return json.loads(row[0])
+
+    def __setitem__(self, session_id, context):
+        data = json.dumps(context)
+        with self._lock:
+            self._conn.execute(
+                "INSERT OR REPLACE INTO sessions (session_id, data, last_access) VALUES (?, ?, ?)",
+                (session_id, data, time.time()),
+            )
+            self.purge_expired()
+
+    def __delitem__(self, session_id):
+        with self._lock:
+            cursor = self._conn.execute("DELETE FROM sessions WHERE session_id = ?", (session_id,))
+        if cursor.rowcount == 0:
+            raise KeyError(session_id)
+
+    def __contains__(self, session_id):
+        with self._lock:
+            row = self._conn.execute(
+                "SELECT 1 FROM sessions WHERE session_id = ?", (session_id,)
+            ).fetchone()
+        return row is not None
+
+    def __iter__(self) -> Iterator[str]:
+        with self._lock:
+            rows = self._conn.execute("SELECT session_id FROM sessions").fetchall()
+        return iter([row[0] for row in rows])
+
+    def __len__(self):
+        with self._lock:
+            return self._conn.execute("SELECT COUNT(*) FROM sessions").fetchone()[0]
+
+    def update(self, session_id: str, apply: Callable[[Dict], None]) -> Dict:
+        with self._lock:
+            self._conn.execute("BEGIN IMMEDIATE")
+            try:
+                row = self._conn.execute(
+                    "SELECT data FROM sessions WHERE session_id = ?", (session_id,)
+                ).fetchone()
+                if row is None:
+                    raise KeyError(session_id)
+                context = json.loads(row[0])
+                apply(context)
+                self._conn.execute(
+                    "UPDATE sessions SET data = ?, last_access = ? WHERE session_id = ?",
+                    (json.dumps(context), time.time(), session_id),
+                )
+                self._conn.execute("COMMIT")
+            except BaseException:
+                self._conn.execute("ROLLBACK")
+                raise
+        return context
+
+    def purge_expired(self):
+        if not self.idle_ttl or time.monotonic() - self._last_purge < self.touch_interval:
+            return
+        with self._lock:
+            self._last_purge = time.monotonic()
+            cursor = self._conn.execute(
+                "DELETE FROM sessions WHERE last_access < ?", (time.time() - self.idle_ttl,)
+            )
+            self.evictions["ttl"] += cursor.rowcount
+
+    def stats(self) -> Dict[str, int]:
+        with self._lock:
+            count, size = self._conn.execute(
+                "SELECT COUNT(*), COALESCE(SUM(LENGTH(data)), 0) FROM sessions"
+            ).fetchone()
+        return {
+            "backend": "sqlite",
+            "sessions": count,
+            "stored_bytes": size,
+            "evictions_ttl": self.evictions["ttl"],
+        }
+
+    def close(self):
+        with self._lock:
+            self._conn.close()
+
+
+def create_session_store(
+    backend: str = "memory",
+    max_sessions: int = 1000,
+    max_bytes: int = 64 * 1024 * 1024,
+    idle_ttl: float = 2 * 60 * 60,
+    db_path: Optional[str] = None,
+    shards: int = 1,
+) -> SessionStore:
+    """Build a session store.
+
+    ``memory`` keeps everything in-process, split over ``shards`` independent
+    stores; if ``db_path`` is set, evicted sessions are spilled to SQLite rather
+    than dropped. ``sqlite`` keeps every session on disk.
+    """
+    if backend == "memory":
+        spill = SQLiteSessionStore(db_path) if db_path else None
+        if shards <= 1:
+            return MemorySessionStore(max_sessions, max_bytes, idle_ttl, spill=spill)
+        return ShardedSessionStore([
+            MemorySessionStore(max(max_sessions // shards, 1), max_bytes // shards, idle_ttl, spill=spill)
+            for _ in range(shards)
+        ])
+    if backend == "sqlite":
+        return SQLiteSessionStore(db_path or "sessions.db", idle_ttl)
+    raise ValueError(f"Unknown session store backend: {backend}")
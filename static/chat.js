@@ -5,6 +5,9 @@ const userInput = document.getElementById('user-input');
 const messagesContainer = document.getElementById('messages');
 const chatWindow = document.getElementById('chat-window');
 const printButton = document.getElementById('print-btn');
+const newPatientButton = document.getElementById('new-patient-btn');
+// Set while a reply is streaming, so repeated Enter presses don't send overlapping turns
+let inFlight = false;
 
 sendButton.addEventListener('click', sendMessage);
 userInput.addEventListener('keydown', (event) => {
@@ -13,10 +16,28 @@ userInput.addEventListener('keydown', (event) => {
     }
 });
 printButton.addEventListener('click', printConversation);
+newPatientButton.addEventListener('click', startNewPatient);
 
 async function initializeChat() {
+    // Pick up this browser's session if it still exists, e.g. after a reload or a
+    // server restart; only start a new one when there is none (401) or it is gone (404).
+    // "New Patient" starts a new session explicitly.
+    await startSession('/resume');
+}
+
+async function startNewPatient() {
+    if (inFlight) return;
+    if (!confirm('Start a new interview with a different patient? The current conversation will be closed.')) return;
+    messagesContainer.replaceChildren();
+    await startSession('/new-context');
+}
+
+async function startSession(endpoint) {
     try {
-        const response = await fetch('/new-context', { method: 'POST' });
+        let response = await fetch(endpoint, { method: 'POST' });
+        if (endpoint === '/resume' && (response.status === 401 || response.status === 404)) {
+            response = await fetch('/new-context', { method: 'POST' });
+        }
         if (!response.ok) {
             throw new Error('Network response was not ok');
         }
@@ -38,6 +59,9 @@ async function initializeChat() {
         }
         
         addMessage('system', formattedMessage, true);
+        for (const message of data.history || []) {
+            addMessage(message.role === 'user' ? 'user' : 'bot', message.content);
+        }
     } catch (error) {
         console.error('Error:', error);
         addMessage('error', "Error: Unable to start a new chat session.");
@@ -46,9 +70,13 @@ async function initializeChat() {
 }
 
 async function sendMessage() {
+    if (inFlight) return;
     const message = userInput.value.trim();
     if (message === "") return;
 
+    inFlight = true;
+    sendButton.disabled = true;
+    newPatientButton.disabled = true;
     addMessage('user', message);
     userInput.value = '';
 
@@ -63,6 +91,12 @@ async function sendMessage() {
             })
         });
 
+        // Rate limited (429), or the session is missing (401) or has expired (404)
+        if ([401, 404, 429].includes(response.status)) {
+            const data = await response.json();
+            addMessage('error', data.detail);
+            return;
+        }
         if (!response.ok) {
             throw new Error('Network response was not ok');
         }
@@ -71,13 +105,16 @@ async function sendMessage() {
         const decoder = new TextDecoder();
         let botMessage = '';
         let botElement = null;
+        let pending = '';
 
         while (true) {
             const { done, value } = await reader.read();
             if (done) break;
 
-            const chunk = decoder.decode(value);
-            const lines = chunk.split('\n\n');
+            // Frames can be split across reads; keep any incomplete frame for the next one
+            pending += decoder.decode(value, { stream: true });
+            const lines = pending.split('\n\n');
+            pending = lines.pop();
             for (const line of lines) {
                 if (line.startsWith('data: ')) {
                     const data = JSON.parse(line.slice(6));
@@ -90,8 +127,21 @@ async function sendMessage() {
                         botMessage += data.delta;
                         botElement.textContent = botMessage;
                         scrollToBottom();
+                    } else if (data.replace) {
+                        // The reply contradicted the patient profile and was cut short
+                        if (!botElement) {
+                            botElement = document.createElement('div');
+                            botElement.className = 'message bot';
+                            messagesContainer.appendChild(botElement);
+                        }
+                        botMessage = data.replace;
+                        botElement.textContent = botMessage;
+                        scrollToBottom();
                     } else if (data.done) {
                         break;
+                    } else if (data.busy) {
+                        addMessage('error', data.message);
+                        break;
                     } else if (data.error) {
                         addMessage('error', `Error: ${data.error}`);
                         break;
@@ -102,9 +152,12 @@ async function sendMessage() {
     } catch (error) {
         console.error('Error:', error);
         addMessage('error', "Error: Unable to get response from the server.");
+    } finally {
+        inFlight = false;
+        sendButton.disabled = false;
+        newPatientButton.disabled = false;
+        userInput.focus();
     }
-
-    userInput.focus();
 }
 
 function addMessage(sender, content, isHTML = false) {
@@ -0,0 +1,106 @@
+import asyncio
+import json
+from json.encoder import encode_basestring_ascii
+from typing import AsyncIterator, Callable, Dict, List, Optional
+from models import STREAM_FLUSH_INTERVAL, STREAM_FLUSH_CHARS, STREAM_KEEPALIVE_INTERVAL
+
+KEEPALIVE_FRAME = b": keep-alive\n\n"
+_DELTA_PREFIX = b'data: {"delta": '
+_FRAME_SUFFIX = b"}\n\n"
+_END = object()
+
+
+def encode_event(payload: Dict) -> bytes:
+    """Encode an arbitrary SSE ``data:`` frame."""
+    return b"data: " + json.dumps(payload).encode() + b"\n\n"
+
+
+def encode_delta(text: str) -> bytes:
+    """Encode a ``{"delta": text}`` frame without building and serializing a dict.
+
+    Produces the same bytes as ``encode_event({"delta": text})``.
+    """
+    return _DELTA_PREFIX + encode_basestring_ascii(text).encode() + _FRAME_SUFFIX
+
+
+async def text_deltas(stream, on_first_token: Optional[Callable[[], None]] = None) -> AsyncIterator[str]:
+    """Yield the text of each ``content_block_delta`` event from an Anthropic message stream.
+
+    ``on_first_token`` is called once, when the first text arrives.
+    """
+    async for chunk in stream:
+        if chunk.type == "content_block_delta":
+            if on_first_token is not None:
+                on_first_token()
+                on_first_token = None
+            yield chunk.delta.text
+
+
+async def coalesced_sse(
+    deltas: AsyncIterator[str],
+    parts: List[str],
+    flush_interval: float = STREAM_FLUSH_INTERVAL,
+    flush_chars: int = STREAM_FLUSH_CHARS,
+    keepalive_interval: float = STREAM_KEEPALIVE_INTERVAL,
+) -> AsyncIterator[bytes]:
+    """Turn a stream of text deltas into pre-encoded SSE delta frames.
+
+    Deltas are buffered until ``flush_chars`` characters have built up or the
+    oldest buffered delta is ``flush_interval`` seconds old, then sent as one
+    frame. A keep-alive comment is sent when nothing has been written for
+    ``keepalive_interval`` seconds (e.g. while waiting for the first token).
+    Every delta is also appended to ``parts`` so the caller can ``"".join`` the
+    full reply once at the end. Errors from ``deltas`` are re-raised here.
+    """
+    loop = asyncio.get_running_loop()
+    queue: asyncio.Queue = asyncio.Queue()
+
+    async def pump():
+        try:
+            async for text in deltas:
+                queue.put_nowait(text)
+        except Exception as exc:
+            queue.put_nowait(exc)
+        else:
+            queue.put_nowait(_END)
+
+    reader = asyncio.create_task(pump())
+    buffer: List[str] = []
+    buffered = 0
+    deadline = 0.0
+    try:
+        while True:
+            try:
+                item = queue.get_nowait()
+            except asyncio.QueueEmpty:
+                timeout = max(deadline - loop.time(), 0) if buffer else keepalive_interval
+                try:
+                    item = await asyncio.wait_for(queue.get(), timeout)
+                except asyncio.TimeoutError:
+                    if buffer:
+                        yield encode_delta("".join(buffer))
+                        buffer.clear()
+                        buffered = 0
+                    else:
+                        yield KEEPALIVE_FRAME
+                    continue
+
+            if item is _END:
+                break
+            if isinstance(item, Exception):
+                raise item
+
+            parts.append(item)
+            buffer.append(item)
+            buffered += len(item)
+            if len(buffer) == 1:
+                deadline = loop.time() + flush_interval
+            if buffered >= flush_chars or loop.time() >= deadline:
+                yield encode_delta("".join(buffer))
+                buffer.clear()
+                buffered = 0
+
+        if buffer:
+            yield encode_delta("".join(buffer))
+    finally:
+        reader.cancel()
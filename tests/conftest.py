@@ -0,0 +1,36 @@
+import os
+import tempfile
+
+# Set before the app's modules are imported: keep the transcript log and signing key
+# out of the working directory, and turn off limits that would trip up quick tests
+_tmp = tempfile.mkdtemp()
+os.environ.setdefault("THERABOT_TRANSCRIPT_DB_PATH", os.path.join(_tmp, "transcripts.db"))
+os.environ.setdefault("THERABOT_SESSION_SECRET", "test-secret")
+os.environ.setdefault("THERABOT_SESSION_TURNS_PER_MINUTE", "0")
+os.environ.setdefault("THERABOT_IP_TURNS_PER_MINUTE", "0")
+os.environ.setdefault("THERABOT_RESPONSE_CACHE", "0")
+os.environ.setdefault("THERABOT_PRECOMPILED_TEMPLATES_PATH", "")
+
+import pytest
+from fastapi.testclient import TestClient
+
+from anthropic_client import ClientManager, get_client_manager
+from benchmarks.fake_anthropic import FakeAsyncAnthropic
+
+
+@pytest.fixture
+def fake_client():
+    return FakeAsyncAnthropic(ttft=0, tokens_per_sec=0, reply_length=12, record=True)
+
+
+@pytest.fixture
+def app_client(fake_client):
+    """A test client for the app, with the Anthropic API replaced by ``fake_client``."""
+    from main import app
+
+    manager = ClientManager(fake_client)
+    app.dependency_overrides[get_client_manager] = lambda: manager
+    with TestClient(app) as client:
+        yield client
+    app.dependency_overrides.pop(get_client_manager, None)
+
@@ -0,0 +1,94 @@
+import json
+import time
+
+from models import user_contexts
+
+
+def sse_events(response):
+    return [json.loads(frame[6:]) for frame in response.text.split("\n\n") if frame.startswith("data: ")]
+
+
+def test_turn_survives_eviction_mid_reply(app_client, fake_client):
+    session = app_client.post("/new-context").cookies["session_id"]
+    open_stream = fake_client.messages.stream
+
+    def evict_then_stream(**kwargs):
+        # The session is pushed out of the store (count, bytes or TTL) while the reply streams
+        del user_contexts[session]
+        return open_stream(**kwargs)
+
+    fake_client.messages.stream = evict_then_stream
+    events = sse_events(app_client.post("/chat", data={"message": "How have you been sleeping?"}))
+
+    assert events[-1]["done"]
+    assert not any("error" in event for event in events)
+    history = app_client.post("/resume").json()["history"]
+    assert [message["role"] for message in history] == ["user", "assistant"]
+    assert history[0]["content"] == "How have you been sleeping?"
+
+
+def test_cache_hits_skip_upstream_slots(app_client, monkeypatch):
+    import routes
+    from anthropic_client import ClientManager, get_client_manager
+    from benchmarks.fake_anthropic import FakeAsyncAnthropic
+    from main import app
+    from response_cache import ResponseCache
+
+    monkeypatch.setattr(routes, "response_cache", ResponseCache(16))
+    app_client.post("/new-context", params={"disorder": "Panic Disorder", "seed": 7})
+    sse_events(app_client.post("/chat", data={"message": "What brings you in today?"}))
+
+    # Every upstream slot is taken and nobody may wait for one
+    saturated = ClientManager(FakeAsyncAnthropic(), max_concurrent=0, max_waiting=0)
+    monkeypatch.setitem(app.dependency_overrides, get_client_manager, lambda: saturated)
+    app_client.post("/new-context", params={"disorder": "Panic Disorder", "seed": 7})
+    replayed = sse_events(app_client.post("/chat", data={"message": "What brings you in today?"}))
+    assert replayed[-1]["done"] and replayed[-1]["cached"]
+
+    uncached = sse_events(app_client.post("/chat", data={"message": "How is work going?"}))
+    assert uncached[-1]["busy"]
+
+
+def _breakpoints(blocks):
+    return [block for block in blocks if isinstance(block, dict) and "cache_control" in block]
+
+
+def test_cache_control_breakpoints(app_client, fake_client):
+    session = app_client.post("/new-context").cookies["session_id"]
+    sse_events(app_client.post("/chat", data={"message": "What brings you in today?"}))
+    # As if earlier turns had been pruned and folded into the rolling summary
+    user_contexts.update(session, lambda context: context.update(history_summary="Summary of earlier turns"))
+    sse_events(app_client.post("/chat", data={"message": "How long has that been going on?"}))
+
+    assert len(fake_client.calls) == 2
+    request = fake_client.calls[-1]
+    system_prompt, summary = request["system"]
+    assert system_prompt["cache_control"] == {"type": "ephemeral"}
+    assert summary == {"type": "text", "text": "Summary of earlier turns"}
+
+    *history, newest = request["messages"]
+    assert [message["role"] for message in history] == ["user", "assistant"]
+    assert all(isinstance(message["content"], str) for message in history)
+    assert newest["role"] == "user"
+    assert _breakpoints(newest["content"]) == [
+        {"type": "text", "text": "How long has that been going on?", "cache_control": {"type": "ephemeral"}}
+    ]
+
+
+def test_profile_pool_filled_at_startup(app_client):
+    from utils import profile_pool
+
+    # Filled in the background once the app has started
+    deadline = time.monotonic() + 5
+    while profile_pool.stats()["ready"] < profile_pool.size and time.monotonic() < deadline:
+        time.sleep(0.01)
+    assert profile_pool.stats()["ready"] == profile_pool.size
+    misses = profile_pool.stats()["misses"]
+    app_client.post("/new-context")
+    assert profile_pool.stats()["misses"] == misses
+
+
+def test_metrics_count_sessions(app_client):
+    app_client.post("/new-context")
+    active = [line for line in app_client.get("/metrics").text.splitlines() if line.startswith("therabot_active_sessions ")]
+    assert active == [f"therabot_active_sessions {len(user_contexts)}"]
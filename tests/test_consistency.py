@@ -0,0 +1,52 @@
+import pytest
+
+from consistency import StreamingConsistencyChecker, find_inconsistency
+
+PROFILE = {"name": "Alex", "age": 34}
+
+
+@pytest.mark.parametrize("text", [
+    "I'm 2 years sober now.",
+    "I am 6 feet tall",
+    "I'm 5 foot 4",
+    "I'm 1 of 3 kids",
+    "I'm 3 years into my degree",
+    "I am 2 drinks in by noon",
+    "I'm 20 minutes away.",
+    "I'm 2.5 hours from home.",
+    "My 5-year-old keeps me up at night.",
+    "Call me Al.",
+    "My name is Al, short for Alex.",
+    "I'm London-based.",
+    "I'm Sam's friend.",
+    "I'm 34 years old.",
+    "I am a 34-year-old teacher.",
+    "I'm 34, if that matters.",
+    "I'm Alex.",
+])
+def test_consistent_speech(text):
+    assert find_inconsistency(text, PROFILE) is None
+
+
+@pytest.mark.parametrize("text, reason", [
+    ("I'm 29 years old.", "age"),
+    ("I am a 29-year-old nurse.", "age"),
+    ("I'm 29, by the way.", "age"),
+    ("Honestly? I'm 29", "age"),
+    ("I turned 29.", "age"),
+    ("My name is Jordan.", "name"),
+    ("I'm Jordan, nice to meet you.", "name"),
+])
+def test_contradictions(text, reason):
+    assert find_inconsistency(text, PROFILE) == reason
+
+
+def test_age_split_across_chunks():
+    checker = StreamingConsistencyChecker(PROFILE)
+    assert checker.feed("Well, I'm 3") is None
+    assert checker.feed("4 years old and tired.") is None
+    assert checker.finish() is None
+
+    checker = StreamingConsistencyChecker(PROFILE)
+    assert checker.feed("Well, I'm 2") is None
+    assert (checker.feed("9 years old and tired.") or checker.finish()) == "age"
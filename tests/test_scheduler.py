@@ -0,0 +1,54 @@
+import asyncio
+
+from anthropic_client import ClientManager
+from scheduler import FairScheduler
+
+
+async def _served_order(manager: ClientManager, sessions):
+    """Start turns for ``sessions`` in order on one global slot; return the order they're served in."""
+    served = []
+
+    async def turn(session, n):
+        async with manager.slot(session):
+            served.append(f"{session}-{n}")
+            await asyncio.sleep(0.01)
+
+    tasks = []
+    for n, session in enumerate(sessions):
+        tasks.append(asyncio.create_task(turn(session, n)))
+        # Let each turn reach the queue before the next one arrives
+        await asyncio.sleep(0)
+    await asyncio.gather(*tasks)
+    return served
+
+
+def test_heavy_session_does_not_starve_classroom():
+    # One session allowed to run and queue several turns, against a classroom whose students
+    # (possibly all behind one IP) each send a single turn after it
+    manager = ClientManager(client=None, max_concurrent=1, per_session=4, max_waiting=100)
+    classroom = [f"student{n}" for n in range(3)]
+    served = asyncio.run(_served_order(manager, ["heavy"] * 4 + classroom))
+    # Every student is served before the heavy session's third turn
+    assert [turn.split("-")[0] for turn in served] == ["heavy", "heavy", *classroom, "heavy", "heavy"]
+
+
+def test_round_robin_between_keys():
+    async def scenario():
+        scheduler = FairScheduler(1)
+        await scheduler.acquire("a")
+        order = []
+
+        async def waiter(key, name):
+            await scheduler.acquire(key)
+            order.append(name)
+            scheduler.release()
+
+        tasks = []
+        for key, name in (("a", "a1"), ("a", "a2"), ("a", "a3"), ("b", "b1"), ("b", "b2")):
+            tasks.append(asyncio.create_task(waiter(key, name)))
+            await asyncio.sleep(0)
+        scheduler.release()
+        await asyncio.gather(*tasks)
+        return order
+
+    assert asyncio.run(scenario()) == ["a1", "b1", "a2", "b2", "a3"]
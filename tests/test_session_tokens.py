@@ -0,0 +1,23 @@
+import pytest
+
+from session_tokens import mint_session_id, verify_session_id
+
+SECRET = b"test-secret"
+
+
+def test_minted_ids_verify():
+    token = mint_session_id(SECRET)
+    assert verify_session_id(token, SECRET)
+    assert not verify_session_id(token, b"another-secret")
+
+
+@pytest.mark.parametrize("token", ["", "None", "abc", "abc.", ".def", "abc.def", "abc.déf", "ä" * 10, "a." + "b" * 200])
+def test_rejects_forged_ids(token):
+    assert not verify_session_id(token, SECRET)
+
+
+@pytest.mark.parametrize("path", ["/chat", "/resume"])
+def test_non_ascii_cookie_is_unauthorized(app_client, path):
+    # httpx only sends ASCII headers, so the cookie is written as raw UTF-8 bytes
+    response = app_client.post(path, data={"message": "hi"}, headers={"cookie": "session_id=abc.déf".encode()})
+    assert response.status_code == 401
@@ -0,0 +1,137 @@
+import asyncio
+import json
+import sqlite3
+import threading
+import time
+from typing import Dict, List, Optional, Tuple
+from metrics import log_event
+
+
+class TranscriptLog:
+    """Append-only log of sessions and completed turns, persisted to SQLite in the background.
+
+    ``record_session`` and ``record_turn`` only queue the record; a background
+    task writes queued records in one transaction every ``flush_interval``
+    seconds, or sooner once ``batch_size`` are waiting, on a worker thread so
+    the event loop never waits on disk.
+    """
+
+    def __init__(self, path: str = "transcripts.db", flush_interval: float = 0.5, batch_size: int = 200):
+        self.path = path
+        self.flush_interval = flush_interval
+        self.batch_size = batch_size
+        self._pending: List[Tuple] = []
+        self._conn: Optional[sqlite3.Connection] = None
+        self._db_lock = threading.Lock()
+        self._flush_lock: Optional[asyncio.Lock] = None
+        self._wakeup: Optional[asyncio.Event] = None
+        self._flusher: Optional[asyncio.Task] = None
+        self.written = 0
+        self.batches = 0
+
+    def _connect(self) -> sqlite3.Connection:
+        if self._conn is None:
+            conn = sqlite3.connect(self.path, check_same_thread=False)
+            conn.execute("PRAGMA journal_mode=WAL")
+            conn.execute("PRAGMA synchronous=NORMAL")
+            conn.execute(
+                "CREATE TABLE IF NOT EXISTS sessions ("
+                "session_id TEXT PRIMARY KEY, created REAL NOT NULL, patient_profile TEXT NOT NULL)"
+            )
+            conn.execute(
+                "CREATE TABLE IF NOT EXISTS turns ("
+                "id INTEGER PRIMARY KEY AUTOINCREMENT, session_id TEXT NOT NULL, ts REAL NOT NULL, "
+                "user TEXT NOT NULL, assistant TEXT NOT NULL)"
+            )
+            conn.execute("CREATE INDEX IF NOT EXISTS turns_session ON turns (session_id, id)")
+            conn.commit()
+            self._conn = conn
+        return self._conn
+
+    def record_session(self, session_id: str, patient_profile: Dict):
+        self._enqueue(("session", session_id, time.time(), json.dumps(patient_profile)))
+
+    def record_turn(self, session_id: str, user_text: str, assistant_text: str):
+        self._enqueue(("turn", session_id, time.time(), user_text, assistant_text))
+
+    def _enqueue(self, record: Tuple):
+        self._pending.append(record)
+        if self._flusher is None or self._flusher.done():
+            self._wakeup = asyncio.Event()
+            self._flush_lock = asyncio.Lock()
+            self._flusher = asyncio.get_running_loop().create_task(self._run())
+        elif len(self._pending) >= self.batch_size:
+            self._wakeup.set()
+
+    async def _run(self):
+        while True:
+            try:
+                await asyncio.wait_for(self._wakeup.wait(), self.flush_interval)
+            except asyncio.TimeoutError:
+                pass
+            self._wakeup.clear()
+            try:
+                await self.flush()
+            except Exception as e:
+                log_event("transcript_write_error", error=str(e), error_type=type(e).__name__)
+
+    async def flush(self):
+        if self._flush_lock is None:
+            return
+        async with self._flush_lock:
+            if not self._pending:
+                return
+            batch, self._pending = self._pending, []
+            try:
+                await asyncio.to_thread(self._write, batch)
+            except Exception:
+                # Put the batch back so it is retried on the next flush
+                self._pending[:0] = batch
+                raise
+
+    def _write(self, batch: List[Tuple]):
+        sessions = [record[1:] for record in batch if record[0] == "session"]
+        turns = [record[1:] for record in batch if record[0] == "turn"]
+        with self._db_lock:
+            conn = self._connect()
+            with conn:
+                conn.executemany(
+                    "INSERT OR REPLACE INTO sessions (session_id, created, patient_profile) VALUES (?, ?, ?)",
+                    sessions,
+                )
+                conn.executemany(
+                    "INSERT INTO turns (session_id, ts, user, assistant) VALUES (?, ?, ?, ?)", turns
+                )
+        self.written += len(batch)
+        self.batches += 1
+
+    async def load(self, session_id: str) -> Optional[Tuple[Dict, List[Tuple[str, str]]]]:
+        """The patient profile and ``(user, assistant)`` turns logged for a session, or None."""
+        await self.flush()
+        return await asyncio.to_thread(self._read, session_id)
+
+    def _read(self, session_id: str):
+        with self._db_lock:
+            conn = self._connect()
+            row = conn.execute(
+                "SELECT patient_profile FROM sessions WHERE session_id = ?", (session_id,)
+            ).fetchone()
+            if row is None:
+                return None
+            turns = conn.execute(
+                "SELECT user, assistant FROM turns WHERE session_id = ? ORDER BY id", (session_id,)
+            ).fetchall()
+        return json.loads(row[0]), turns
+
+    async def close(self):
+        if self._flusher is not None:
+            self._flusher.cancel()
+            self._flusher = None
+        await self.flush()
+        with self._db_lock:
+            if self._conn is not None:
+                self._conn.close()
+                self._conn = None
+
+    def stats(self) -> Dict[str, int]:
+        return {"pending": len(self._pending), "written": self.written, "batches": self.batches}
@@ -2,25 +2,41 @@ import os
 import random
 import re
 import uuid
-from fastapi import Request
-from typing import Dict, List
-from models import disorders, user_contexts, MAX_CONTEXT_LENGTH
-
-def generate_patient_profile():
-    disorder_name = random.choice(list(disorders.keys()))
+from fastapi import Depends, HTTPException, Request
+from typing import Dict, List, Optional
+from consistency import find_inconsistency
+from prompts import render_system_prompt, render_patient_reminder, render_system_message
+from models import (
+    disorders,
+    PATIENT_NAMES,
+    user_contexts,
+    transcript_log,
+    MAX_CONTEXT_TOKENS,
+    PRUNE_TARGET,
+    SUMMARY_MAX_TOKENS,
+    SUMMARIZE_PRUNED_TURNS,
+    PROFILE_POOL_SIZE,
+    PROFILE_POOL_SEED,
+    SESSION_SECRET,
+)
+from metrics import log_event
+from profile_pool import ProfilePool
+from session_store import SIZE_KEY, estimate_size
+from session_tokens import mint_session_id, verify_session_id
+
+DISORDER_NAMES = tuple(disorders)
+GENDERS = ("Male", "Female")
+
+def generate_patient_profile(rng: random.Random = random, disorder_name: Optional[str] = None):
+    """Draw a random patient. Pass a seeded ``rng`` to get the same patient every time."""
+    if disorder_name is None:
+        disorder_name = rng.choice(DISORDER_NAMES)
     disorder_info = disorders[disorder_name]
 
-    age = random.randint(*disorder_info["age_range"])
-    gender = random.choice(["Male", "Female"])
-    name = random.choice(
-        ["Alex", "Jordan", "Taylor", "Casey", "Riley", "Morgan", "Jamie", "Cameron", "Avery",
-        "Quinn", "Skylar", "Charlie", "Frankie", "Finley", "Emerson", "Sage", "Remy", "Parker",
-        "Hayden", "Drew", "Phoenix", "River", "Sawyer", "Rowan", "Blair", "Kendall", "Marlowe",
-        "Harper", "Reese", "Dakota", "Jadin", "Ash", "Casey", "Ainsley", "Ariel", "Angel", "Addison",
-        "Aspen", "Deven", "Julian", "Jesse", "Terry", "London", "Max", "Morgan", "Noel", "Pat",
-        "Peyton", "Ray", "Reagan", "Riley", "Roan", "Sam", "Shae", "Tate", "Tony"]
-    )
-    symptoms = random.sample(disorder_info["symptoms"], k=len(disorder_info["symptoms"]))
+    age = rng.randint(*disorder_info["age_range"])
+    gender = rng.choice(GENDERS)
+    name = rng.choice(PATIENT_NAMES)
+    symptoms = rng.sample(disorder_info["symptoms"], k=len(disorder_info["symptoms"]))
 
     return {
         "name": name,
@@ -42,105 +58,188 @@ def generate_patient_summary(patient_profile):
     )
     return summary
 
-async def new_user_context():
-    patient_profile = generate_patient_profile()
-    system_prompt = create_system_prompt(patient_profile)
+def build_user_context(rng: random.Random = random, disorder_name: Optional[str] = None) -> Dict:
+    return context_from_profile(generate_patient_profile(rng, disorder_name))
+
+def context_from_profile(patient_profile: Dict) -> Dict:
+    system_message = render_system_message(patient_profile)
     patient_summary = generate_patient_summary(patient_profile)  # Generate the patient summary
-    user_context = {
-        "messages": [{"role": "system", "content": patient_summary}],  # Start the session with the summary
+    context = {
+        "patient_summary": patient_summary,  # Shown to the interviewer, never sent to the model
+        # API-ready history: {"role", "content"} dicts alternating user/assistant, handed to the
+        # client as-is. Token estimates are kept in a parallel list so the dicts stay API-shaped.
+        "messages": [],
+        "message_tokens": [],
+        "history_summary": None,
+        "turns": 0,  # Completed turns, including ones since pruned from the history
         "patient_profile": patient_profile,
-        "system_prompt": system_prompt,
+        "system_message": system_message,  # System prompt plus reminder, rendered once per session
     }
-    print("PATIENT NAME: ", patient_profile['name'])
+    # Measured once here, then kept up to date by append_turn and prune_context
+    context[SIZE_KEY] = estimate_size(context)
+    return context
+
+profile_pool = ProfilePool(build_user_context, size=PROFILE_POOL_SIZE, seed=PROFILE_POOL_SEED)
+
+async def new_user_context(disorder_name: Optional[str] = None, seed: Optional[int] = None):
+    """Build a new session context.
+
+    Without a disorder or seed the context comes ready-made from the profile
+    pool; instructor-assigned cases are built on the spot, reproducibly when
+    ``seed`` is given.
+    """
+    if disorder_name is None and seed is None:
+        user_context = profile_pool.take()
+    else:
+        rng = random.Random(seed) if seed is not None else random
+        user_context = build_user_context(rng, disorder_name)
+    log_event(
+        "new_patient",
+        name=user_context["patient_profile"]["name"],
+        disorder=user_context["patient_profile"]["disorder"],
+    )
     return user_context
 
-async def get_user_session(request: Request):
+def restore_user_context(patient_profile: Dict, turns) -> Dict:
+    """Rebuild a session context from its logged profile and ``(user, assistant)`` turns."""
+    context = context_from_profile(patient_profile)
+    for user_text, assistant_text in turns:
+        append_turn(context, user_text, assistant_text)
+    prune_context(context)
+    return context
+
+async def get_user_context(session_id: str) -> Dict:
+    """Look up a session, rehydrating it from the transcript log if this worker doesn't have it.
+
+    Raises ``KeyError`` if the session is unknown to both.
+    """
+    try:
+        return await user_contexts.aget(session_id)
+    except KeyError:
+        logged = await transcript_log.load(session_id)
+        if logged is None:
+            raise
+    context = restore_user_context(*logged)
+    await user_contexts.aset(session_id, context)
+    return context
+
+def new_session_id() -> str:
+    return mint_session_id(SESSION_SECRET)
+
+async def get_user_session(request: Request) -> Optional[str]:
+    """The session ID from the cookie, or None if there is none or it wasn't issued by us."""
     session_id = request.cookies.get("session_id")
+    if session_id is None or not verify_session_id(session_id, SESSION_SECRET):
+        return None
+    return session_id
+
+async def require_user_session(session_id: Optional[str] = Depends(get_user_session)) -> str:
+    if session_id is None:
+        raise HTTPException(status_code=401, detail="No valid session. Please reload the page to start a new one.")
     return session_id
 
 def create_system_prompt(patient_profile):
-    prompt = f"""
-You are role-playing as {patient_profile['name']}, a {patient_profile['age']}-year-old {patient_profile['gender'].lower()}.
-You are experiencing symptoms consistent with {patient_profile['disorder']}, but you don't know your diagnosis.
-Your symptoms include:
-
-"""
-    for symptom in patient_profile['symptoms']:
-        prompt += f"- {symptom}\n"
-
-    prompt += f"""
-During this intake interview, respond as {patient_profile['name']} would, exhibiting behaviors and communication styles consistent with your symptoms.
-Stay in character throughout the conversation.
-
-At the beginning of the interview, you feel hesitant and cautious about sharing personal information.
-You may provide brief or vague responses initially.
-As the interviewer builds rapport and you feel more comfortable, gradually open up and share more details about your experiences and feelings.
-
-IMPORTANT:
-- Do not mention your diagnosis by name or use clinical terms to describe your condition.
-- Express your experiences and feelings in layman's terms, as someone who is seeking help but doesn't have a medical understanding of their condition.
-- Avoid volunteering detailed information unless specifically asked.
-- Your initial responses should reflect a level of guardedness appropriate for someone meeting a clinician for the first time.
-- As trust develops, allow your responses to become more detailed and revealing, consistent with your symptoms.
-- Try to imitate natural spoken dialog, which means using short responses most often and long responses only as appropiate and as rapport builds. For example, not every response requires more than a sentence or two.
-- It is important that while playing the role of a patient you do not become a caricature. Always remember you are a full, complex person, not just the disorder. 
-
-The interviewer will ask you questions as part of a clinical intake interview.
-Provide responses that are appropriate for your experiences, keeping in mind that this is likely your first time seeking professional help.
-
-Additionally, remember that {patient_profile['name']} may:
-- Feel nervous about the interview and will not want to share information.
-- Require reassurance or gentle prompting to feel comfortable opening up.
-- Respond positively to empathetic and non-judgmental questions from the interviewer.
-"""
-    return prompt.strip()
+    return render_system_prompt(patient_profile)
 
 def generate_patient_reminder(patient_profile):
     """Generate a reminder of the patient's details to be injected into each interaction."""
-    reminder = f"Remember, you are role-playing as {patient_profile['name']}, a {patient_profile['age']}-year-old {patient_profile['gender'].lower()}. "
-
-    if patient_profile["disorder"] == "Autism Spectrum Disorder":
-        reminder += (
-            "You may struggle with social situations, changes in routine, and have intense interests in specific topics. "
-        )
-    elif patient_profile["disorder"] == "Major Depressive Disorder":
-        reminder += (
-            "You may feel persistently sad, lack energy and motivation, and have difficulty finding joy in activities. "
-        )
-
-    reminder += "Remember, you're not aware of any specific diagnosis. Express your experiences in your own words, without using clinical terms."
-    return reminder
+    return render_patient_reminder(patient_profile)
 
 def is_response_consistent(response, patient_profile):
-    # Check for age consistency
-    age_pattern = r"\b(\d+)(?:\s*[-–]\s*|\s+)(?:years?|yrs?)\s+old\b"
-    age_match = re.search(age_pattern, response, re.IGNORECASE)
-    if age_match and int(age_match.group(1)) != patient_profile["age"]:
-        return False
-
-    # Check for name consistency
-    name_pattern = r"\b(I'm|I am|my name is)\s+([A-Z][a-z]+)\b"
-    name_match = re.search(name_pattern, response, re.IGNORECASE)
-    if name_match and name_match.group(2) != patient_profile["name"]:
-        return False
-
-    return True
+    # Checks first-person age and name statements against the profile
+    return find_inconsistency(response, patient_profile) is None
 
 def generate_consistent_response(patient_profile):
     response = f"I'm sorry if I wasn't clear before. My name is {patient_profile['name']}, and I'm {patient_profile['age']} years old. "
-
-    if patient_profile["disorder"] == "Autism Spectrum Disorder":
-        response += (
-            "I've been having a hard time in social situations and dealing with changes. Sometimes I get really focused on certain topics or routines."
-        )
-    elif patient_profile["disorder"] == "Major Depressive Disorder":
-        response += (
-            "I've been feeling really down lately, and I'm having trouble finding energy or interest in things I used to enjoy."
-        )
-
+    response += disorders[patient_profile["disorder"]]["self_description"]
     return response
 
-def prune_context(context: List[Dict[str, str]]) -> List[Dict[str, str]]:
-    if len(context) > MAX_CONTEXT_LENGTH:
-        return context[-MAX_CONTEXT_LENGTH:]
-    return context
+def estimate_tokens(text: str) -> int:
+    """Cheap token estimate (~4 characters per token plus per-message overhead)."""
+    return len(text) // 4 + 4
+
+def make_message(role: str, content: str) -> Dict[str, str]:
+    """An API-ready message. The content string is stored as-is and shared, never copied."""
+    return {"role": role, "content": content}
+
+# Approximate encoded size of a message dict and its token estimate, besides the content
+MESSAGE_OVERHEAD_BYTES = 48
+
+def message_size(message: Dict[str, str]) -> int:
+    return len(message["content"]) + MESSAGE_OVERHEAD_BYTES
+
+def append_turn(context: Dict, user_text: str, assistant_text: str):
+    """Append a completed turn to the session history, estimating its tokens and size once."""
+    turn = (make_message("user", user_text), make_message("assistant", assistant_text))
+    context["messages"] += turn
+    context["message_tokens"] += (estimate_tokens(user_text), estimate_tokens(assistant_text))
+    context["turns"] = context.get("turns", 0) + 1
+    if SIZE_KEY in context:
+        context[SIZE_KEY] += sum(message_size(message) for message in turn)
+
+# Appended to a reply that was cut off because the student disconnected mid-stream
+INTERRUPTED_MARKER = "[reply interrupted]"
+
+SUMMARY_HEADER = "Summary of earlier parts of this interview (these turns are no longer shown):"
+
+def _first_sentence(text: str, limit: int = 160) -> str:
+    text = " ".join(text.split())
+    match = re.match(r"(.+?[.!?])(\s|$)", text)
+    sentence = match.group(1) if match else text
+    return sentence if len(sentence) <= limit else sentence[: limit - 3].rstrip() + "..."
+
+def summarize_turns(previous: Optional[str], dropped: List[Dict], max_tokens: int = SUMMARY_MAX_TOKENS) -> str:
+    """Fold dropped turns into a compressed rolling summary, keeping the newest lines within budget."""
+    lines = previous.splitlines()[1:] if previous else []
+    for message in dropped:
+        speaker = "Interviewer" if message["role"] == "user" else "You"
+        lines.append(f"- {speaker}: {_first_sentence(message['content'])}")
+    while len(lines) > 1 and estimate_tokens("\n".join([SUMMARY_HEADER, *lines])) > max_tokens:
+        lines.pop(0)
+    return "\n".join([SUMMARY_HEADER, *lines])
+
+def prune_context(
+    context: Dict,
+    max_tokens: int = MAX_CONTEXT_TOKENS,
+    summarize: bool = SUMMARIZE_PRUNED_TURNS,
+    target: float = PRUNE_TARGET,
+):
+    """Drop the oldest turns, in place, once the session history exceeds ``max_tokens``.
+
+    History is then cut down to ``target`` times ``max_tokens``, so the prompt
+    prefix (and its cache entry) stays stable for several turns rather than
+    changing every turn at the budget. Turns are dropped as whole user/assistant
+    pairs so the history still starts with a user message, and the latest turn
+    is never dropped. With ``summarize``, dropped turns are folded into the
+    session's rolling summary.
+    """
+    messages = context["messages"]
+    tokens = context["message_tokens"]
+    total = sum(tokens)
+    if context.get("history_summary"):
+        total += estimate_tokens(context["history_summary"])
+
+    start = 0
+    # A history that somehow starts with an assistant turn is invalid for the API
+    while start < len(messages) and messages[start]["role"] != "user":
+        total -= tokens[start]
+        start += 1
+    limit = max_tokens * target if total > max_tokens else max_tokens
+    while total > limit and len(messages) - start > 2:
+        total -= tokens[start]
+        start += 1
+        while start < len(messages) and messages[start]["role"] != "user":
+            total -= tokens[start]
+            start += 1
+
+    if start == 0:
+        return
+    removed = sum(message_size(message) for message in messages[:start])
+    if summarize:
+        previous = context.get("history_summary") or ""
+        context["history_summary"] = summarize_turns(previous, messages[:start])
+        removed += len(previous) - len(context["history_summary"])
+    if SIZE_KEY in context:
+        context[SIZE_KEY] -= removed
+    del messages[:start]
+    del tokens[:start]